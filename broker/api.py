@@ -1,16 +1,68 @@
 # api.py
 
-from flask import Flask, request, jsonify, send_file, Response
+from flask import Flask, Request, request, jsonify, send_file, Response, g
 from flask_cors import CORS
+import hashlib
+import io
+import json
 import os
 import time
 import state
-from utils import send_json_message, log_message
-from client_server import forward_train_message, forward_inference_message
+import telemetry
+from metrics import family, render, with_labels
+from protocol import ENCODING_BINARY
+from utils import send_json_message, log_message, summarize
+from client_server import forward_inference_message, is_error_response
+
+class InMemoryRequest(Request):
+    """Keeps multipart uploads in memory (Werkzeug spools files over 500 KB to a temporary file)."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
 
 app = Flask(__name__)
+app.request_class = InMemoryRequest
+app.config["MAX_CONTENT_LENGTH"] = state.MAX_UPLOAD_BYTES
 CORS(app)
 
+def endpoint_label():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    telemetry.http_in_flight.inc(endpoint=endpoint_label())
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = endpoint_label()
+    telemetry.http_requests.inc(endpoint=endpoint, method=request.method, status=str(response.status_code))
+    telemetry.http_latency.observe(time.perf_counter() - g.request_started, endpoint=endpoint)
+    g.request_recorded = True
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    if "request_started" not in g:
+        return
+    endpoint = endpoint_label()
+    telemetry.http_in_flight.dec(endpoint=endpoint)
+    if not g.get("request_recorded"):  # an unhandled exception skipped after_request
+        telemetry.http_requests.inc(endpoint=endpoint, method=request.method, status="500")
+        telemetry.http_latency.observe(time.perf_counter() - g.request_started, endpoint=endpoint)
+
+def select_inference_node(node_name, model_name):
+    """Returns the named node, or lets the router pick among the nodes that hold model_name."""
+    if node_name:
+        target_node = state.registry.get(node_name)
+        if not target_node:
+            return None, (jsonify({"error": f"Node '{node_name}' not found"}), 404)
+        return target_node, None
+    candidates = state.registry.with_model(model_name)
+    if not candidates:
+        return None, (jsonify({"error": f"No node has model '{model_name}'"}), 404)
+    return state.router.choose(candidates), None
+
 @app.route('/get_json', methods=['GET']) # /get_json?node=node0&json=test -> this gets models/test/test.json from node0's directory
 def get_json():
     node_name = request.args.get("node")
@@ -18,29 +70,63 @@ def get_json():
     if not node_name or not json_name:
         return jsonify({"error": "Missing 'node' or 'json' parameter"}), 400
         
-    json_key = f"{node_name}:{json_name}" # this is for keeping track of the response; node0:test
-
-    target_node = next((node for node in state.nodes if node["name"] == node_name), None)
+    target_node = state.registry.get(node_name)
     if not target_node:
         return jsonify({"error": f"Node '{node_name}' not found"}), 404
 
+    request_key = state.json_responses.create("get_json") # this is for keeping track of the response
     send_json_message(target_node["socket"], {
         "type": "GET_JSON",
         "name": node_name,
-        "json_name": json_name
+        "json_name": json_name,
+        "request_key": request_key
+    }, node_name)
+    try:
+        json_data = state.json_responses.wait(request_key, timeout=5) # time out in 5 seconds
+    except TimeoutError:
+        return jsonify({"error": "Timeout waiting for client response"}), 504
+    if is_error_response(json_data):
+        return jsonify(json_data), 404
+    return jsonify(json_data)
+
+@app.route('/profile_trace', methods=['GET']) # /profile_trace?node=node0&trace=test.train -> profiles/test.train.trace.json on node0
+def profile_trace():
+    node_name = request.args.get("node")
+    trace_id = request.args.get("trace")
+    if not node_name or not trace_id:
+        return jsonify({"error": "Missing 'node' or 'trace' parameter"}), 400
+
+    target_node = state.registry.get(node_name)
+    if not target_node:
+        return jsonify({"error": f"Node '{node_name}' not found"}), 404
+
+    request_key = state.json_responses.create("trace")
+    send_json_message(target_node["socket"], {
+        "type": "GET_TRACE",
+        "name": node_name,
+        "trace": trace_id,
+        "request_key": request_key
     }, node_name)
-    timeout = 5 # time out in 5 seconds
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        if json_key in state.json_responses:
-            json_data = state.json_responses.pop(json_key)
-            return jsonify(json_data)
-        time.sleep(0.1)
-    return jsonify({"error": "Timeout waiting for client response"}), 504
+    try:
+        trace_data = state.json_responses.wait(request_key, timeout=15)  # traces can be tens of MB
+    except TimeoutError:
+        return jsonify({"error": "Timeout waiting for client response"}), 504
+    if is_error_response(trace_data):
+        return jsonify(trace_data), 404
+    # the node sends the trace file's bytes as they are; they are already Chrome trace JSON
+    return Response(bytes(trace_data["trace"]), mimetype="application/json",
+                    headers={"Content-Disposition": f'attachment; filename="{trace_id}.trace.json"'})
 
 @app.route('/nodes', methods=['GET'])
 def get_nodes():
-    nodes_info = [{"name": node["name"], "models": node.get("models", [])} for node in state.nodes]
+    nodes_info = [{
+        "name": node["name"],
+        "models": node.get("models", []),
+        "model_cache": node.get("model_cache"),
+        "load": state.router.stats(node["name"]),
+        "capacity": node.get("capacity"),
+        "last_heartbeat_seconds": round(time.monotonic() - node["last_seen"], 1) if "last_seen" in node else None
+    } for node in state.registry.snapshot()]
     return jsonify({"nodes": nodes_info})
 
 @app.route('/images', methods=['GET'])
@@ -61,61 +147,227 @@ def get_image():
 
 @app.route('/train', methods=['POST'])
 def train():
+    """Queues a training job and returns its id; "wait": true blocks for up to 120 s for the result."""
     data = request.json
-    node = data["node"]
-    target_node = next((n for n in state.nodes if n["name"] == node), None)
-    if not target_node:
-        return jsonify({"error": f"Node '{node}' not found"}), 404
-    model_name = data["modelName"]
-    model_type = data["modelType"]
-    epochs = data["epochs"]
-    batch_size = data["batchSize"]
-    learning_rate = data["learningRate"]
-    train_key = f"train:{int(time.time()*1000)}"
+    # "nodes" runs one data-parallel job across several nodes; "node" trains on a single node
+    node_names = data.get("nodes") or [data["node"]]
+    for node in node_names:
+        if not state.registry.get(node):
+            return jsonify({"error": f"Node '{node}' not found"}), 404
+    if len(set(node_names)) != len(node_names):
+        return jsonify({"error": "Each node may appear only once in 'nodes'"}), 400
     train_message = {
         "type": "SERVER TRAIN",
-        "modelName": model_name,
-        "modelType": model_type,
-        "epochs": epochs,
-        "batchSize": batch_size,
-        "learningRate": learning_rate,
-        "train_key": train_key
+        "modelName": data["modelName"],
+        "modelType": data["modelType"],
+        "epochs": data["epochs"],
+        "batchSize": data["batchSize"],
+        "learningRate": data["learningRate"]
     }
-    forward_train_message(target_node, train_message)
-    timeout = 120
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        if train_key in state.json_responses:
-            train_result = state.json_responses.pop(train_key)
-            return jsonify(train_result)
-        time.sleep(0.1)
-    return jsonify({"status": "Training initiated"})
+    # optional DataLoader, precision, execution and export options, forwarded only when the caller sets them
+    for field in ("numWorkers", "prefetchFactor", "persistentWorkers", "pinMemory", "torchscript", "quantize", "precision",
+                  "channelsLast", "compile", "profile", "profileTrace"):
+        if field in data:
+            train_message[field] = data[field]
+    distributed_options = None
+    if len(node_names) > 1:
+        distributed_options = {
+            "master_addr": data.get("masterAddr"),
+            "master_port": data.get("masterPort") or state.next_master_port()
+        }
+    job_id = state.jobs.submit(node_names, train_message, distributed_options)
+    if data.get("wait"):
+        job = state.jobs.wait(job_id, timeout=120)
+        if job["status"] == "completed":
+            return jsonify(job["result"])
+        return jsonify(job), 202 if job["status"] in ("queued", "running") else 200
+    job = state.jobs.get(job_id)
+    return jsonify({"status": job["status"], "job": job_id}), 202
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({"jobs": state.jobs.snapshot(request.args.get("status"))})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = state.jobs.get(job_id)
+    if not job:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = state.jobs.cancel(job_id)
+    if not job:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+    return jsonify(job)
+
+@app.route('/train/<job_id>/stream', methods=['GET'])
+def train_stream(job_id):
+    """Server-sent events for a training job: batch and epoch metrics, then completed or failed."""
+    if job_id not in state.training_progress:
+        return jsonify({"error": f"Training job '{job_id}' not found"}), 404
+    try:
+        start = int(request.headers.get("Last-Event-ID", -1)) + 1
+    except ValueError:
+        return jsonify({"error": "Invalid Last-Event-ID"}), 400
+
+    def events():
+        for item in state.training_progress.subscribe(job_id, start):
+            if item is None:
+                yield ": keepalive\n\n"
+                continue
+            index, event = item
+            yield f"id: {index}\nevent: {event.get('event', 'message')}\ndata: {json.dumps(event)}\n\n"
+
+    return Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.route('/inference', methods=['POST'])
 def inference():
-    data = request.json
+    # Three request forms: JSON with an imagePath on the node, a multipart upload in the
+    # "image" field, or the raw image as the body with modelName/node in the query string
+    image_bytes, image_name = None, None
+    if request.is_json:
+        data = request.json
+    elif request.mimetype == "multipart/form-data":
+        data = request.form
+        upload = request.files.get("image")
+        if upload is None:
+            return jsonify({"error": "Missing 'image' file"}), 400
+        image_bytes = upload.stream.getvalue()  # shares the upload's buffer rather than copying it
+        image_name = upload.filename
+    else:
+        data = request.args
+        image_bytes = request.get_data(cache=False)
     node_name = data.get("node")
-    image_path = data["imagePath"]
-    model_name = data["modelName"]
-    inference_key = f"inference:{int(time.time()*1000)}"
+    image_path = data.get("imagePath")
+    model_name = data.get("modelName")
+    precision = data.get("precision")
+    # form and query string values arrive as strings, JSON ones as booleans
+    profile = {field: data.get(field) in (True, "true", "1") for field in ("profile", "profileTrace")}
+    if not model_name or (image_bytes is None and not image_path):
+        return jsonify({"error": "Missing 'modelName' and an 'imagePath' or image upload"}), 400
+    if image_bytes is not None and not image_bytes:
+        return jsonify({"error": "Empty image upload"}), 400
+    target_node, error = select_inference_node(node_name, model_name)
+    if error:
+        return error
+    # Uploads are content-addressed; path requests are not, since the file lives on the node
+    cache_key = None
+    weights_hash = target_node.get("model_hashes", {}).get(model_name)
+    # a profiled request is always run, since its timings are what the caller wants
+    if image_bytes is not None and weights_hash and not any(profile.values()):
+        cache_key = (model_name, weights_hash, precision, hashlib.sha256(image_bytes).hexdigest())
+        cached_result = state.result_cache.get(cache_key)
+        if cached_result is not None:
+            response = jsonify({**cached_result, "image": image_name or "upload"})
+            response.headers["X-Cache"] = "HIT"
+            return response
+    inference_key = state.json_responses.create("inference")
     inference_message = {
         "type": "SERVER INFERENCE",
         "inference_key": inference_key,
-        "image_path": image_path,
         "model_name": model_name,
     }
+    if precision:
+        inference_message["precision"] = precision
+    for field, enabled in profile.items():
+        if enabled:
+            inference_message[field] = True
+    encoding = None
+    if image_bytes is not None:
+        # JSON cannot carry bytes, so uploads always go out as a binary frame
+        inference_message["image_bytes"] = image_bytes
+        inference_message["image_name"] = image_name or "upload"
+        encoding = ENCODING_BINARY
+    else:
+        inference_message["image_path"] = image_path
     # log inference_message
-    print(f"INFO: Inference message: {inference_message}")
-    target_node = next((node for node in state.nodes if node["name"] == node_name), None)
-    if not target_node:
-        return jsonify({"error": f"Node '{node_name}' not found"}), 404
-    forward_inference_message(target_node, inference_message)
-    timeout = 15
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        if inference_key in state.json_responses:
-            inference_result = state.json_responses.pop(inference_key)
-            return jsonify(inference_result)
-        time.sleep(0.1)
-    return jsonify({"error": "Timeout waiting for inference response"}), 504
+    print(f"INFO: Inference message: {summarize(inference_message)} -> {target_node['name']}")
+    started = state.router.start(target_node["name"])
+    try:
+        forward_inference_message(target_node, inference_message, encoding)
+        inference_result = state.json_responses.wait(inference_key, timeout=15)
+    except TimeoutError:
+        return jsonify({"error": "Timeout waiting for inference response"}), 504
+    finally:
+        elapsed = state.router.finish(target_node["name"], started)
+        telemetry.node_latency.observe(elapsed, node=target_node["name"], kind="inference")
+    if is_error_response(inference_result):
+        return jsonify(inference_result), 502
+    if "profile" in inference_result:
+        # the trace stays on the node that served the request, which the caller may not have picked
+        inference_result["profile"]["node"] = target_node["name"]
+    response = jsonify(inference_result)
+    if cache_key:
+        state.result_cache.put(cache_key, inference_result)
+        response.headers["X-Cache"] = "MISS"
+    return response
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(state.result_cache.stats())
+
+@app.route('/inference/batch', methods=['POST'])
+def inference_batch():
+    data = request.json
+    node_name = data.get("node")
+    model_name = data.get("modelName")
+    image_paths = data.get("imagePaths")
+    if not model_name or not isinstance(image_paths, list) or not image_paths:
+        return jsonify({"error": "Missing 'modelName' or non-empty 'imagePaths' list"}), 400
+    if len(image_paths) > state.MAX_BATCH_IMAGES:
+        return jsonify({"error": f"At most {state.MAX_BATCH_IMAGES} images per batch"}), 400
+    target_node, error = select_inference_node(node_name, model_name)
+    if error:
+        return error
+    batch_key = state.json_responses.create("batch")
+    batch_message = {
+        "type": "SERVER BATCH INFERENCE",
+        "batch_key": batch_key,
+        "image_paths": image_paths,
+        "model_name": model_name,
+    }
+    if data.get("precision"):
+        batch_message["precision"] = data["precision"]
+    started = state.router.start(target_node["name"])
+    try:
+        forward_inference_message(target_node, batch_message)
+        batch_result = state.json_responses.wait(batch_key, timeout=15 + len(image_paths))
+    except TimeoutError:
+        return jsonify({"error": "Timeout waiting for batch inference response"}), 504
+    finally:
+        elapsed = state.router.finish(target_node["name"], started, items=len(image_paths))
+        telemetry.node_latency.observe(elapsed, node=target_node["name"], kind="batch")
+    if is_error_response(batch_result):
+        return jsonify(batch_result), 502
+    return jsonify(batch_result)
+
+def state_families():
+    """Gauges read from broker state at scrape time."""
+    nodes = state.registry.snapshot()
+    cache = state.result_cache.stats()
+    return [
+        family("broker_nodes_connected", "gauge", "Connected nodes", [({}, len(nodes))]),
+        family("broker_node_inflight_requests", "gauge", "Requests routed to a node and not answered yet",
+               [({"node": node["name"]}, state.router.stats(node["name"])["inflight"]) for node in nodes]),
+        family("broker_node_last_heartbeat_seconds", "gauge", "Seconds since the node's last heartbeat",
+               [({"node": node["name"]}, round(time.monotonic() - node["last_seen"], 3)) for node in nodes if "last_seen" in node]),
+        family("broker_pending_responses", "gauge", "Node replies the broker is waiting for",
+               [({}, len(state.json_responses))]),
+        family("broker_training_jobs", "gauge", "Training jobs by status (queued is the queue depth)",
+               [({"status": status}, count) for status, count in state.jobs.counts().items()]),
+        family("broker_result_cache_hits_total", "counter", "Inference result cache hits", [({}, cache["hits"])]),
+        family("broker_result_cache_misses_total", "counter", "Inference result cache misses", [({}, cache["misses"])]),
+        family("broker_result_cache_evictions_total", "counter", "Inference result cache evictions", [({}, cache["evictions"])]),
+        family("broker_result_cache_hit_ratio", "gauge", "Inference result cache hit ratio", [({}, cache["hit_rate"])]),
+        family("broker_result_cache_bytes", "gauge", "Inference result cache size", [({}, cache["memory_bytes"])]),
+    ]
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text format: broker metrics plus the latest counters each node pushed."""
+    families = telemetry.registry.snapshot() + state_families()
+    for node in state.registry.snapshot():
+        families += with_labels(node.get("metrics", []), node=node["name"])
+    return Response(render(families), mimetype="text/plain; version=0.0.4")
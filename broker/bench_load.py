@@ -0,0 +1,305 @@
+# bench_load.py
+#
+# Load test of the whole broker on localhost. For each node count it starts
+# node_server.py in a child process, attaches N simulated nodes that speak
+# the real protocol (CLIENT CONNECT, NODE INFO, heartbeats, JSON_RESPONSE)
+# and answer after a service time drawn from --service-time. It then drives
+# /inference, /get_json and /nodes at each target rate, open loop, and reports
+# throughput, latency percentiles, errors, timeouts and the broker's CPU use
+# and memory.
+#
+#   python3 bench_load.py --nodes 1,4,16 --rates 50,100,200 --duration 10 --service-time exp:20
+#
+# Latency is measured from the time a request was due to be sent, not when a
+# worker got to it, so a saturated broker shows up as queueing delay instead
+# of a silently lower request rate.
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from protocol import ENCODING_JSON, encode_frame
+from bench_node_server import raise_fd_limit, read_message
+
+MODEL_NAME = "bench"
+CLASS_NAMES = ["cat", "cow", "dog"]
+ENDPOINTS = ["inference", "get_json", "nodes"]
+TIMEOUT_STATUSES = (504,)
+
+def service_time_sampler(spec):
+    """Parses "fixed:MS", "uniform:LO:HI", "exp:MEAN" or "lognormal:MEDIAN:SIGMA" (times in ms) into a sampler of seconds."""
+    kind, *params = spec.split(":")
+    try:
+        params = [float(p) for p in params]
+        if kind == "fixed":
+            (ms,) = params
+            return lambda: ms / 1000
+        if kind == "uniform":
+            low, high = params
+            return lambda: random.uniform(low, high) / 1000
+        if kind == "exp":
+            (mean,) = params
+            return lambda: random.expovariate(1 / mean) / 1000 if mean > 0 else 0.0
+        if kind == "lognormal":
+            median, sigma = params
+            return lambda: random.lognormvariate(0, sigma) * median / 1000
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid service time '{spec}'. Use fixed:MS, uniform:LO:HI, exp:MEAN or lognormal:MEDIAN:SIGMA.")
+
+def parse_mix(spec):
+    weights = {}
+    for part in spec.split(","):
+        endpoint, _, weight = part.partition("=")
+        if endpoint not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{endpoint}'. Choose from: {', '.join(ENDPOINTS)}.")
+        weights[endpoint] = float(weight or 1)
+    return weights
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")  # utime + stime
+
+def memory_stats(pid):
+    stats = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM", "Threads"):
+                stats[key] = int(value.split()[0])
+    return stats
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+async def simulated_node(host, port, name, service_time, concurrency, heartbeat_interval, ready):
+    reader, writer = await asyncio.open_connection(host, port)
+
+    def send(message):
+        writer.write(encode_frame(message, ENCODING_JSON))
+
+    send({"type": "CLIENT CONNECT", "name": name})
+    await read_message(reader)  # SERVER ACK
+    send({"type": "NODE INFO", "name": name, "models": [MODEL_NAME]})
+    await writer.drain()
+    ready.release()
+    slots = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+
+    async def heartbeats():
+        while True:
+            await asyncio.sleep(heartbeat_interval)
+            send({"type": "CLIENT PING", "name": name})
+
+    async def serve(message):
+        if slots:
+            await slots.acquire()
+        try:
+            await asyncio.sleep(service_time())
+        finally:
+            if slots:
+                slots.release()
+        if message["type"] == "SERVER INFERENCE":
+            data = {"predicted_class": random.choice(CLASS_NAMES), "image": message.get("image_path")}
+            send({"type": "JSON_RESPONSE", "name": name, "inference_key": message["inference_key"], "data": data})
+        else:
+            data = {"model": message.get("json_name"), "classes": CLASS_NAMES}
+            send({"type": "JSON_RESPONSE", "name": name, "request_key": message["request_key"], "data": data})
+
+    heartbeat_task = asyncio.create_task(heartbeats())
+    tasks = set()
+    try:
+        while True:
+            message = await read_message(reader)
+            if message.get("type") in ("SERVER INFERENCE", "GET_JSON"):
+                task = asyncio.create_task(serve(message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        heartbeat_task.cancel()
+        writer.close()
+
+async def run_nodes(host, port, count, service_spec, concurrency, heartbeat_interval, ready_event):
+    service_time = service_time_sampler(service_spec)
+    ready = asyncio.Semaphore(0)
+    tasks = [asyncio.create_task(simulated_node(host, port, f"sim{i}", service_time, concurrency, heartbeat_interval, ready))
+             for i in range(count)]
+    for _ in range(count):
+        await ready.acquire()
+    ready_event.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+def node_process(host, port, count, service_spec, concurrency, heartbeat_interval, ready_event):
+    raise_fd_limit()
+    asyncio.run(run_nodes(host, port, count, service_spec, concurrency, heartbeat_interval, ready_event))
+
+def start_broker(host, server_port, api_port):
+    env = dict(os.environ, HOST=host, SERVER_PORT=str(server_port), API_PORT=str(api_port))
+    here = os.path.dirname(os.path.abspath(__file__))
+    # the broker logs every message; that cost is part of what is measured, the output is not
+    broker = subprocess.Popen([sys.executable, "node_server.py"], cwd=here, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://{host}:{api_port}/nodes", timeout=1).read()
+            return broker
+        except OSError:
+            if broker.poll() is not None:
+                raise RuntimeError(f"Broker exited with code {broker.returncode}")
+            time.sleep(0.1)
+    broker.kill()
+    raise RuntimeError("Broker did not start")
+
+def build_request(base_url, endpoint, node_names):
+    if endpoint == "inference":
+        body = json.dumps({"modelName": MODEL_NAME, "imagePath": "./images/test/cat/0.jpg"}).encode()
+        return urllib.request.Request(f"{base_url}/inference", data=body, headers={"Content-Type": "application/json"})
+    if endpoint == "get_json":
+        return urllib.request.Request(f"{base_url}/get_json?node={random.choice(node_names)}&json={MODEL_NAME}")
+    return urllib.request.Request(f"{base_url}/nodes")
+
+def send_request(request, due, timeout):
+    """Returns (outcome, seconds since due), outcome being "ok", "error" or "timeout"."""
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+        outcome = "ok"
+    except urllib.error.HTTPError as e:
+        outcome = "timeout" if e.code in TIMEOUT_STATUSES else "error"
+    except (TimeoutError, socket.timeout):
+        outcome = "timeout"
+    except (urllib.error.URLError, ConnectionError):
+        outcome = "error"
+    return outcome, time.perf_counter() - due
+
+def drive(base_url, node_names, rate, duration, mix, workers, timeout):
+    """Sends Poisson arrivals at rate requests/s for duration seconds and collects per-endpoint outcomes."""
+    endpoints, weights = zip(*mix.items())
+    results = {endpoint: [] for endpoint in endpoints}
+    lock = threading.Lock()
+
+    def record(endpoint, future):
+        with lock:
+            results[endpoint].append(future.result())
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        start = time.perf_counter()
+        due = start
+        while due < start + duration:
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            endpoint = random.choices(endpoints, weights)[0]
+            future = pool.submit(send_request, build_request(base_url, endpoint, node_names), due, timeout)
+            future.add_done_callback(lambda f, endpoint=endpoint: record(endpoint, f))
+            due += random.expovariate(rate)
+    elapsed = time.perf_counter() - start
+    return results, elapsed
+
+def summarize(outcomes, elapsed):
+    latencies = sorted(seconds for outcome, seconds in outcomes if outcome == "ok")
+    ms = lambda value: round(value * 1000, 1) if value is not None else None
+    return {
+        "requests": len(outcomes),
+        "throughput": round(len(latencies) / elapsed, 1),
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "errors": sum(1 for outcome, _ in outcomes if outcome == "error"),
+        "timeouts": sum(1 for outcome, _ in outcomes if outcome == "timeout")
+    }
+
+def bench(args, node_count, rates, mix):
+    server_port, api_port = free_port(), free_port()
+    broker = start_broker(args.host, server_port, api_port)
+    ready = multiprocessing.Event()
+    nodes = multiprocessing.Process(target=node_process, daemon=True, args=(
+        args.host, server_port, node_count, args.service_time, args.node_concurrency, args.heartbeat_interval, ready))
+    nodes.start()
+    results = []
+    try:
+        if not ready.wait(30):
+            raise RuntimeError("Simulated nodes did not connect")
+        time.sleep(0.5)  # let the broker handle every NODE INFO before requests are routed
+        base_url = f"http://{args.host}:{api_port}"
+        node_names = [f"sim{i}" for i in range(node_count)]
+        for rate in rates:
+            cpu_before = cpu_seconds(broker.pid)
+            outcomes, elapsed = drive(base_url, node_names, rate, args.duration, mix, args.workers, args.timeout)
+            broker_cpu = (cpu_seconds(broker.pid) - cpu_before) / elapsed
+            memory = memory_stats(broker.pid)
+            all_outcomes = [outcome for endpoint_outcomes in outcomes.values() for outcome in endpoint_outcomes]
+            results.append({
+                "nodes": node_count,
+                "rate": rate,
+                **summarize(all_outcomes, elapsed),
+                "endpoints": {endpoint: summarize(endpoint_outcomes, elapsed) for endpoint, endpoint_outcomes in outcomes.items()},
+                "broker_cpu_percent": round(broker_cpu * 100, 1),
+                "broker_rss_kb": memory.get("VmRSS"),
+                "broker_peak_rss_kb": memory.get("VmHWM"),
+                "broker_threads": memory.get("Threads")
+            })
+    finally:
+        nodes.terminate()
+        nodes.join()
+        broker.terminate()
+        broker.wait()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the broker with simulated nodes.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--nodes", default="1,4,16", help="Comma separated simulated node counts")
+    parser.add_argument("--rates", default="25,50,100,200", help="Comma separated target request rates (requests/s)")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per rate")
+    parser.add_argument("--mix", default="inference=8,get_json=1,nodes=1", help="Endpoint weights, e.g. inference=8,get_json=1,nodes=1")
+    parser.add_argument("--service-time", default="exp:20",
+                        help="Node service time in ms: fixed:MS, uniform:LO:HI, exp:MEAN or lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--node-concurrency", type=int, default=1, help="Requests a simulated node serves at once (0 = unlimited)")
+    parser.add_argument("--heartbeat-interval", type=float, default=5, help="Seconds between simulated node heartbeats")
+    parser.add_argument("--workers", type=int, default=256, help="Concurrent HTTP requests the load generator can have open")
+    parser.add_argument("--timeout", type=float, default=30, help="Client side HTTP timeout in seconds")
+    parser.add_argument("--output", help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    service_time_sampler(args.service_time)  # fail on a bad spec before starting anything
+    mix = parse_mix(args.mix)
+    raise_fd_limit()
+    results = []
+    print(f"service time {args.service_time}, node concurrency {args.node_concurrency}, {args.duration:g} s per rate, mix {args.mix}")
+    print(f"{'nodes':>6}{'rate':>7}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}{'timeouts':>10}{'cpu %':>8}{'rss MB':>8}")
+    for node_count in [int(n) for n in args.nodes.split(",")]:
+        try:
+            node_results = bench(args, node_count, [float(r) for r in args.rates.split(",")], mix)
+        except Exception as e:
+            print(f"{node_count:>6}  failed: {e}")
+            results.append({"nodes": node_count, "error": str(e)})
+            continue
+        for r in node_results:
+            print(f"{r['nodes']:>6}{r['rate']:>7g}{r['throughput']:>8}{str(r['p50_ms']):>9}{str(r['p95_ms']):>9}{str(r['p99_ms']):>9}"
+                  f"{r['errors']:>8}{r['timeouts']:>10}{r['broker_cpu_percent']:>8}{r['broker_rss_kb'] / 1024:>8.1f}")
+        results.extend(node_results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,169 @@
+# bench_node_server.py
+#
+# Compares the asyncio node server against the old thread-per-connection model.
+# For each connection count it starts a fresh server in a child process,
+# connects N simulated nodes, has every node send --pings CLIENT PING frames
+# and waits for all SERVER PONG replies.
+#
+#   python3 bench_node_server.py --connections 100,1000,4000 --pings 50
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import sys
+import threading
+import time
+
+import client_server
+from protocol import CODECS, ENCODING_NAMES, HEADER, FrameDecoder, encode_frame
+from client_server import READ_CHUNK_BYTES
+
+def legacy_handle_client(client_socket, address):
+    decoder = FrameDecoder()
+    node_name = "Unknown"
+    try:
+        while True:
+            data = client_socket.recv(READ_CHUNK_BYTES)
+            if not data:
+                break
+            for message in decoder.feed(data):
+                node_name = message.get("name", "Unknown")
+                if not client_server.handle_client_message(client_socket, address, message):
+                    break
+    except Exception:
+        pass
+    finally:
+        client_socket.close()
+        client_server.remove_node(node_name)
+
+def legacy_server(host, port):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, port))
+    server.listen(4096)
+    while True:
+        conn, address = server.accept()
+        threading.Thread(target=legacy_handle_client, args=(conn, address), daemon=True).start()
+
+def run_server(mode, host, port):
+    sys.stdout = open(os.devnull, "w")  # handle_client_message logs every message
+    raise_fd_limit()
+    if mode == "asyncio":
+        client_server.start_client_server(host, port)
+    else:
+        legacy_server(host, port)
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+def process_stats(pid):
+    stats = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("Threads", "VmRSS"):
+                stats[key] = value.strip()
+    return stats
+
+async def wait_for_port(host, port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError(f"Server did not start on {host}:{port}")
+
+async def read_message(reader):
+    version, encoding, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return CODECS[encoding].decode(await reader.readexactly(length))
+
+async def simulated_node(host, port, name, pings, encoding, connected, start):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(encode_frame({"type": "CLIENT CONNECT", "name": name}, encoding))
+    await writer.drain()
+    await read_message(reader)  # SERVER ACK
+    connected.release()
+    await start.wait()
+    writer.write(encode_frame({"type": "CLIENT PING", "name": name}, encoding) * pings)
+    await writer.drain()
+    for _ in range(pings):
+        await read_message(reader)  # SERVER PONG
+    return writer
+
+async def run_clients(host, port, connections, pings, encoding, server_pid):
+    await wait_for_port(host, port)
+    connected = asyncio.Semaphore(0)
+    start = asyncio.Event()
+    connect_start = time.perf_counter()
+    tasks = [asyncio.create_task(simulated_node(host, port, f"bench{i}", pings, encoding, connected, start))
+             for i in range(connections)]
+    for _ in range(connections):
+        await connected.acquire()
+    connect_time = time.perf_counter() - connect_start
+    message_start = time.perf_counter()
+    start.set()
+    writers = await asyncio.gather(*tasks)
+    message_time = time.perf_counter() - message_start
+    stats = process_stats(server_pid)  # sampled while every node is still connected
+    for writer in writers:
+        writer.close()
+    return connect_time, message_time, stats
+
+def bench(mode, host, port, connections, pings, encoding):
+    server = multiprocessing.Process(target=run_server, args=(mode, host, port), daemon=True)
+    server.start()
+    try:
+        connect_time, message_time, stats = asyncio.run(run_clients(host, port, connections, pings, encoding, server.pid))
+    finally:
+        server.terminate()
+        server.join()
+    messages = connections * pings * 2  # one ping in, one pong out
+    return {
+        "mode": mode,
+        "connections": connections,
+        "connect_seconds": round(connect_time, 3),
+        "messages_per_second": round(messages / message_time),
+        "server_threads": int(stats.get("Threads", 0)),
+        "server_rss": stats.get("VmRSS"),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the broker's node-facing server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--connections", default="100,500,1000,2000,4000", help="Comma separated connection counts")
+    parser.add_argument("--pings", type=int, default=20, help="Pings per connection")
+    parser.add_argument("--modes", default="threaded,asyncio", help="Comma separated: threaded, asyncio")
+    parser.add_argument("--encoding", choices=ENCODING_NAMES, default="json", help="Payload encoding used by the simulated nodes")
+    parser.add_argument("--output", help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    fd_limit = raise_fd_limit()
+    results = []
+    print(f"{'mode':<10}{'conns':>8}{'connect s':>12}{'msgs/s':>12}{'threads':>10}{'rss':>14}")
+    for connections in [int(c) for c in args.connections.split(",")]:
+        if connections * 2 + 64 > fd_limit:
+            print(f"Skipping {connections} connections: file descriptor limit is {fd_limit}")
+            continue
+        for mode in args.modes.split(","):
+            try:
+                result = bench(mode, args.host, args.port, connections, args.pings, ENCODING_NAMES[args.encoding])
+            except Exception as e:
+                result = {"mode": mode, "connections": connections, "error": str(e)}
+                print(f"{mode:<10}{connections:>8}  failed: {e}")
+            else:
+                print(f"{mode:<10}{connections:>8}{result['connect_seconds']:>12}{result['messages_per_second']:>12}"
+                      f"{result['server_threads']:>10}{result['server_rss']:>14}")
+            results.append(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
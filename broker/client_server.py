@@ -1,32 +1,104 @@
 # client_server.py
-import json
+import asyncio
 import threading
-import socket
+import time
+from protocol import FrameDecoder, ProtocolError, ENCODING_JSON
 from utils import log_message, send_json_message
 import state
+import telemetry
 
-def remove_node(node_name):
-    state.nodes = [node for node in state.nodes if node["name"] != node_name]
+READ_CHUNK_BYTES = 256 * 1024
+
+RESPONSE_KEY_FIELDS = ("request_key", "inference_key", "batch_key", "train_key")
+# periodic messages that would drown the log; they are still counted in telemetry
+QUIET_MESSAGE_TYPES = ("NODE METRICS", "CLIENT PING")
+
+def get_response_key(message):
+    for field in RESPONSE_KEY_FIELDS:
+        if message.get(field):
+            return message[field]
+    return None
+
+def is_error_response(data):
+    return isinstance(data, dict) and set(data) == {"error"}
+
+class NodeConnection:
+    """Write side of one node connection, served by the client server's event loop.
+
+    sendall() may be called from any thread (Flask handlers included); the
+    write is handed to the event loop with call_soon_threadsafe so the
+    StreamWriter is only ever touched from the loop thread. Writes queued in
+    the same loop iteration go out in one send.
+    """
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.writer = writer
+        self.encoding = ENCODING_JSON
+        self.pending = []
+        self.name = "Unknown"  # node name, once the node has introduced itself
+
+    def sendall(self, data):
+        if self.writer.is_closing():
+            raise ConnectionError("Node connection is closed")
+        if threading.get_ident() == self.loop_thread:
+            self._write(data)
+        else:
+            self.loop.call_soon_threadsafe(self._write, data)
+
+    def _write(self, data):
+        # Coalesce everything written during one loop iteration into a single send
+        if not self.pending:
+            self.loop.call_soon(self._flush)
+        self.pending.append(data)
+
+    def _flush(self):
+        if not self.writer.is_closing():
+            data = b"".join(self.pending)
+            self.writer.write(data)
+            telemetry.socket_bytes.inc(len(data), node=self.name, direction="out")
+        self.pending.clear()
+
+    def close(self):
+        if threading.get_ident() == self.loop_thread:
+            self.writer.close()
+        else:
+            self.loop.call_soon_threadsafe(self.writer.close)
+
+def remove_node(node_name, client_socket=None):
+    if state.registry.remove(node_name, client_socket):
+        state.router.forget(node_name)
+        state.jobs.node_removed(node_name)
 
 def register_node(client_socket, address, node_name):
-    node_info = {
+    state.registry.register({
+        "socket": client_socket,
         "name": node_name,
         "host": address[0],
         "port": address[1],
-        "models": []
-    }
-    state.nodes.append({"socket": client_socket, **node_info})
+        "models": [],
+        "last_seen": time.monotonic()
+    })
     send_json_message(client_socket, {"type": "SERVER ACK"}, node_name)
 
 def handle_client_message(client_socket, address, message):
     msg_type = message.get("type")
     node_name = message.get("name")
-    log_message("RECEIVE", node_name or "Unknown", message)
+    if msg_type not in QUIET_MESSAGE_TYPES:
+        log_message("RECEIVE", node_name or "Unknown", message)
+    telemetry.messages.inc(direction="in", type=msg_type or "unknown")
 
     if msg_type == "CLIENT CONNECT":
         register_node(client_socket, address, node_name)
     elif msg_type == "CLIENT PING":
-        send_json_message(client_socket, {"type": "SERVER PONG"}, node_name)
+        # pings are heartbeats; the capacity they carry feeds routing and training scheduling
+        changes = {"last_seen": time.monotonic()}
+        if message.get("capacity"):
+            changes["capacity"] = message["capacity"]
+        if state.registry.update(node_name, **changes) and "capacity" in changes:
+            state.jobs.capacity_changed(node_name)
+        send_json_message(client_socket, {"type": "SERVER PONG"}, node_name, quiet=True)
     elif msg_type == "CLIENT DISCONNECT":
         remove_node(node_name)
         send_json_message(client_socket, {"type": "SERVER ACK"}, node_name)
@@ -34,97 +106,128 @@ def handle_client_message(client_socket, address, message):
     elif msg_type == "JSON_RESPONSE":
         node_name = message.get("name", "Unknown")
         json_data = message.get("data")
-        
-        if "json_name" in message:
-            json_key = f"{node_name}:{message['json_name']}"
-        elif "inference_key" in message:
-            json_key = message["inference_key"]
-        else:
+        json_key = get_response_key(message)
+        if not json_key:
             log_message("ERROR", f"Unknown JSON_RESPONSE format: {message}", "")
             return True  # Continue handling other messages
 
-        state.json_responses[json_key] = json_data
+        if "model_cache" in message:
+            state.registry.update_model_cache(node_name, message["model_cache"])
+        if not state.json_responses.complete(json_key, json_data):
+            log_message("WARNING", f"No pending request for response '{json_key}'", "")
         log_message("RECEIVE", node_name, json_data)
+    elif msg_type == "ERROR":
+        json_key = get_response_key(message)
+        if json_key:
+            state.json_responses.complete(json_key, {"error": message.get("message", "Unknown error")})
     elif msg_type == "NODE INFO":
         node_name = message["name"]
         models = message.get("models", [])
-        state.update_node_models(node_name, models)
+        if not state.registry.update_models(node_name, models, message.get("model_hashes")):
+            log_message("WARNING", f"NODE INFO from unregistered node '{node_name}'", "")
+        elif message.get("max_trainings"):
+            state.registry.update(node_name, max_trainings=message["max_trainings"])
         log_message("INFO", f"Updated node info for {node_name}: models={models}", "")
+    elif msg_type == "TRAINING_PROGRESS":
+        event = message.get("event") or {}
+        if event.get("images_per_second") is not None:
+            telemetry.training_throughput.set(event["images_per_second"], node=node_name, model=message.get("model_name"))
+        state.training_progress.publish(message.get("train_key"), event)
+    elif msg_type == "NODE METRICS":
+        state.registry.update(node_name, metrics=message.get("metrics", []))
     elif msg_type == "TRAINING_COMPLETED":
         node_name = message.get("name")
         train_key = message.get("train_key")
         model_name = message.get("model_name")
-        log_message("INFO", f"Training completed for {model_name}", "")
-        state.json_responses[train_key] = message.get("data")
-        # also add the new model to state
-        print(f"")
-        for node in state.nodes:
-            if node["name"] == node_name:
-                models = node.get("models", [])
-                models.append(model_name)
-                state.update_node_models(node_name, models)
-        print(f"state: {state.nodes}")
+        rank = message.get("rank", 0)
+        data = message.get("data") or {}
+        log_message("INFO", f"Training completed for {model_name} (rank {rank})", "")
+        if rank == 0:
+            # results cached for the old weights must not be served for the retrained model
+            state.result_cache.invalidate(model_name)
+            if data.get("returncode") == 0:
+                # also add the new model to state
+                state.registry.add_model(node_name, model_name, message.get("weights_hash"))
+        # other ranks of a distributed job only free their node's training slot
+        state.jobs.rank_completed(train_key, node_name, rank, data)
     elif msg_type == "NEW MODEL ADDED":
         new_model = message.get("new_model")
         models = message.get("models", [])
-        if new_model:
+        if new_model and new_model not in models:
             models.append(new_model)
         log_message("INFO", f"New model '{new_model}' added for node '{node_name}'", "")
-        # state.update_node_models(node_name, models)
+        # the full list also picks up models saved next to the new one, e.g. its int8 variant
+        state.registry.update_models(node_name, models, message.get("model_hashes"))
     else:
         log_message("WARNING", f"Unhandled message type: {msg_type}", "")
 
     return True
 
-def handle_client(client_socket, address):
+async def handle_client(reader, writer):
+    address = writer.get_extra_info("peername")
+    connection = NodeConnection(asyncio.get_running_loop(), writer)
+    decoder = FrameDecoder()
     node_name = "Unknown"
     try:
         while True:
-            data = client_socket.recv(4096).decode()
+            data = await reader.read(READ_CHUNK_BYTES)
             if not data:
                 break
+            telemetry.socket_bytes.inc(len(data), node=node_name, direction="in")
             try:
-                messages = data.strip().split('\n')  # Handle multiple messages
-                for msg in messages:
-                    if msg:
-                        message = json.loads(msg)
-                        node_name = message.get("name", "Unknown")  # Set node_name
-                        if not handle_client_message(client_socket, address, message):
-                            break
-            except json.JSONDecodeError:
-                log_message("ERROR", "Invalid message format received.", "")
-    except Exception as e:
+                messages = decoder.feed(data)  # Handle every complete frame in the buffer
+            except ProtocolError as e:
+                log_message("ERROR", f"Invalid frame from {address}: {e}", "")
+                break
+            if decoder.encoding is not None:
+                connection.encoding = decoder.encoding
+            for message in messages:
+                if not isinstance(message, dict):
+                    log_message("ERROR", "Invalid message format received.", "")
+                    continue
+                node_name = message.get("name", node_name)  # Set node_name
+                connection.name = node_name
+                if not handle_client_message(connection, address, message):
+                    return
+    except ConnectionError as e:
         log_message("ERROR", f"Error handling client: {e}", "")
     finally:
-        client_socket.close()
-        remove_node(node_name)
+        writer.close()
+        remove_node(node_name, connection)
 
+async def evict_silent_nodes(timeout):
+    """Drops nodes that sent no heartbeat for timeout seconds, e.g. hung or cut off without a FIN."""
+    while True:
+        await asyncio.sleep(timeout / 3)
+        deadline = time.monotonic() - timeout
+        for node in state.registry.snapshot():
+            if node.get("last_seen", deadline) < deadline:
+                log_message("WARNING", f"Evicting node '{node['name']}': no heartbeat for {timeout} s", "")
+                remove_node(node["name"], node["socket"])
+                node["socket"].close()
 
-def forward_train_message(target_node, train_message):
-    """Forwrads the train message to the first connected node.
-    """
-    if not state.nodes:
+def forward_inference_message(target_node, inference_message, encoding=None):
+    if not state.registry:
         log_message("ERROR", "No connected nodes available.", "")
         return
-    send_json_message(target_node["socket"], train_message, target_node["name"])
+    send_json_message(target_node["socket"], inference_message, target_node["name"], encoding)
 
-def forward_inference_message(target_node, inference_message):
-    if not state.nodes:
-        log_message("ERROR", "No connected nodes available.", "")
-        return
-    send_json_message(target_node["socket"], inference_message, target_node["name"])
+async def serve_clients(host, port):
+    state.client_loop = asyncio.get_running_loop()
+    state.client_socket = await asyncio.start_server(handle_client, host, port, backlog=4096)
+    log_message("INFO", f"Client server listening on {host}:{port}", "")
+    if state.HEARTBEAT_TIMEOUT > 0:
+        state.eviction_task = asyncio.create_task(evict_silent_nodes(state.HEARTBEAT_TIMEOUT))
+    async with state.client_socket:
+        try:
+            await state.client_socket.serve_forever()
+        except asyncio.CancelledError:
+            pass
 
 def start_client_server(host, port):
-    state.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    state.client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    state.client_socket.bind((host, port))
-    state.client_socket.listen()
-    log_message("INFO", f"Client server listening on {host}:{port}", "")
+    """Serves every node connection from a single asyncio event loop."""
+    asyncio.run(serve_clients(host, port))
 
-    while True:
-        try:
-            client_conn, address = state.client_socket.accept()
-            client_thread = threading.Thread(target=handle_client, args=(client_conn, address))
-            client_thread.start()
-        except OSError:
-            break
+def stop_client_server():
+    if state.client_loop and state.client_socket:
+        state.client_loop.call_soon_threadsafe(state.client_socket.close)
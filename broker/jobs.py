@@ -0,0 +1,222 @@
+# jobs.py
+
+import datetime
+import threading
+import uuid
+from collections import OrderedDict
+from utils import send_json_message, log_message
+
+QUEUED, RUNNING, COMPLETED, FAILED, CANCELLED = "queued", "running", "completed", "failed", "cancelled"
+FINISHED = (COMPLETED, FAILED, CANCELLED)
+
+def now():
+    return datetime.datetime.now().isoformat()
+
+class JobScheduler:
+    """Queues training jobs and starts them when their nodes have a free training slot.
+
+    A node runs at most its advertised max_trainings jobs at once (or
+    default_max_trainings). Jobs start in submission order per node: a queued
+    job holds back every later job that needs one of its nodes, so a
+    distributed job is never starved by single-node jobs behind it. All ranks
+    of a job are started together.
+    """
+
+    def __init__(self, registry, progress, default_max_trainings=1, max_finished_jobs=1000):
+        self.registry = registry
+        self.progress = progress
+        self.default_max_trainings = default_max_trainings
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs = OrderedDict()  # job id -> job dict, in submission order
+        self.queue = []            # ids of queued jobs, oldest first
+        self.running = {}          # node name -> set of job ids holding a slot there
+        self.done = {}             # job id -> threading.Event set when the job finishes
+        self.lock = threading.Lock()
+
+    def submit(self, node_names, train_message, distributed_options=None):
+        """Queues a job for node_names (rank order) and returns its id."""
+        job_id = f"train:{uuid.uuid4().hex}"
+        job = {
+            "id": job_id,
+            "status": QUEUED,
+            "model_name": train_message["modelName"],
+            "nodes": list(node_names),
+            "submitted_at": now(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            "message": {**train_message, "train_key": job_id},
+            "distributed_options": distributed_options or {},
+            "pending_ranks": set(),
+            "cancel_requested": False
+        }
+        self.progress.open(job_id, node_names[0])
+        with self.lock:
+            self.jobs[job_id] = job
+            self.done[job_id] = threading.Event()
+            self.queue.append(job_id)
+            self.progress.publish(job_id, {"event": QUEUED})
+            self._dispatch()
+        return job_id
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return self._describe(job) if job else None
+
+    def snapshot(self, status=None):
+        with self.lock:
+            return [self._describe(job) for job in self.jobs.values() if status is None or job["status"] == status]
+
+    def counts(self):
+        """Number of known jobs per status."""
+        with self.lock:
+            counts = dict.fromkeys((QUEUED, RUNNING) + FINISHED, 0)
+            for job in self.jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+    def wait(self, job_id, timeout):
+        """Waits for the job to finish; returns its description either way."""
+        done = self.done.get(job_id)
+        if done:
+            done.wait(timeout)
+        return self.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancels a queued job, or asks the nodes of a running job to stop it. Returns the job or None."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job["status"] == QUEUED:
+                self.queue.remove(job_id)
+                self._finish(job, CANCELLED, error="Cancelled before it started")
+                self._dispatch()
+            elif job["status"] == RUNNING and not job["cancel_requested"]:
+                job["cancel_requested"] = True
+                for node_name in job["nodes"]:
+                    node = self.registry.get(node_name)
+                    if node:
+                        send_json_message(node["socket"], {"type": "SERVER CANCEL TRAIN", "train_key": job_id}, node_name)
+            return self._describe(job)
+
+    def rank_completed(self, job_id, node_name, rank, data):
+        """Handles a TRAINING_COMPLETED from one rank; rank 0 carries the job's result."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            self._release(job, node_name)
+            if job["status"] == RUNNING and rank == 0:
+                returncode = (data or {}).get("returncode")
+                if job["cancel_requested"]:
+                    self._finish(job, CANCELLED, result=data, error="Cancelled while running")
+                elif returncode == 0:
+                    self._finish(job, COMPLETED, result=data)
+                else:
+                    self._finish(job, FAILED, result=data, error=f"train.py exited with code {returncode}")
+            self._dispatch()
+
+    def node_removed(self, node_name):
+        """Fails the running and queued jobs that need a node that disconnected.
+
+        Ranks on the other nodes keep their slots until they report back.
+        """
+        with self.lock:
+            self.running.pop(node_name, None)
+            for job in list(self.jobs.values()):
+                job["pending_ranks"].discard(node_name)
+                if job["status"] in FINISHED or node_name not in job["nodes"]:
+                    continue
+                if job["status"] == QUEUED:
+                    self.queue.remove(job["id"])
+                self._finish(job, FAILED, error=f"Node '{node_name}' disconnected")
+            self._dispatch()
+
+    def capacity_changed(self, node_name):
+        """Re-checks the queue after a node heartbeat, which may report freed training slots."""
+        with self.lock:
+            if self.queue:
+                self._dispatch()
+
+    def _capacity(self, node_name):
+        node = self.registry.get(node_name)
+        if node is None:
+            return 0
+        return node.get("max_trainings") or self.default_max_trainings
+
+    def _busy(self, node_name):
+        # the node's own count also covers trainings started without the broker
+        node = self.registry.get(node_name) or {}
+        reported = (node.get("capacity") or {}).get("trainings_running", 0)
+        return max(len(self.running.get(node_name, ())), reported)
+
+    def _dispatch(self):
+        blocked = set()
+        for job_id in list(self.queue):
+            job = self.jobs[job_id]
+            nodes = job["nodes"]
+            free = all(self._busy(name) < self._capacity(name) for name in nodes)
+            if free and not blocked.intersection(nodes):
+                self.queue.remove(job_id)
+                self._start(job)
+            else:
+                blocked.update(nodes)
+
+    def _start(self, job):
+        nodes = [self.registry.get(name) for name in job["nodes"]]
+        if not all(nodes):
+            self._finish(job, FAILED, error="A node of this job is no longer connected")
+            return
+        job["status"] = RUNNING
+        job["started_at"] = now()
+        for node in nodes:
+            self.running.setdefault(node["name"], set()).add(job["id"])
+            job["pending_ranks"].add(node["name"])
+        self.progress.publish(job["id"], {"event": RUNNING})
+        message = job["message"]
+        if len(nodes) == 1:
+            send_json_message(nodes[0]["socket"], message, nodes[0]["name"])
+            return
+        # rank 0 hosts the gloo rendezvous, so every other node must be able to reach it
+        options = job["distributed_options"]
+        master_addr = options.get("master_addr") or nodes[0]["host"]
+        for rank, node in enumerate(nodes):
+            send_json_message(node["socket"], {**message, "distributed": {
+                "world_size": len(nodes),
+                "rank": rank,
+                "master_addr": master_addr,
+                "master_port": options["master_port"]
+            }}, node["name"])
+
+    def _release(self, job, node_name):
+        job["pending_ranks"].discard(node_name)
+        self.running.get(node_name, set()).discard(job["id"])
+
+    def _finish(self, job, status, result=None, error=None):
+        job["status"] = status
+        job["finished_at"] = now()
+        job["result"] = result
+        job["error"] = error
+        log_message("INFO", f"Training job {job['id']} {status}", error or "")
+        self.progress.publish(job["id"], {"event": status, "error": error,
+                                          "returncode": (result or {}).get("returncode")}, close=True)
+        self.done[job["id"]].set()
+        self._forget_old_jobs()
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job["status"] in FINISHED]
+        # a finished job that still has ranks running keeps its slots until they report back
+        for job_id in finished[:max(len(finished) - self.max_finished_jobs, 0)]:
+            if not self.jobs[job_id]["pending_ranks"]:
+                del self.jobs[job_id]
+                del self.done[job_id]
+
+    def _describe(self, job):
+        description = {key: job[key] for key in
+                       ("id", "status", "model_name", "nodes", "submitted_at", "started_at", "finished_at", "result", "error")}
+        if job["status"] == QUEUED:
+            description["queue_position"] = self.queue.index(job["id"])
+        return description
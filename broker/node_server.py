@@ -9,8 +9,7 @@ import state
 
 def signal_handler(sig, frame):
     print("\nShutting down the server gracefully...")
-    if state.client_socket:
-        state.client_socket.close()
+    client_server.stop_client_server()
     sys.exit(0)
 
 if __name__ == "__main__":
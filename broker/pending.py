@@ -0,0 +1,61 @@
+# pending.py
+
+import threading
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+class PendingResponses:
+    """Correlates node responses with the API requests waiting on them.
+
+    Each outstanding request owns a Future keyed by a unique request key.
+    The client server completes the future the moment the node answers, so
+    API handlers block on it instead of polling.
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def create(self, prefix):
+        """Registers a new outstanding request and returns its collision-free key."""
+        key = f"{prefix}:{uuid.uuid4().hex}"
+        with self._lock:
+            self._futures[key] = Future()
+        return key
+
+    def complete(self, key, data):
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None or future.done():
+                return False
+            future.set_result(data)
+        return True
+
+    def wait(self, key, timeout):
+        """Returns the response for key, or raises TimeoutError after timeout seconds.
+
+        The entry is always removed, so late responses for timed out requests
+        are dropped instead of accumulating.
+        """
+        with self._lock:
+            future = self._futures.get(key)
+        if future is None:
+            raise KeyError(key)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise TimeoutError(key)
+        finally:
+            self.discard(key)
+
+    def discard(self, key):
+        with self._lock:
+            self._futures.pop(key, None)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._futures
+
+    def __len__(self):
+        with self._lock:
+            return len(self._futures)
@@ -0,0 +1,69 @@
+# progress.py
+
+import threading
+import time
+from collections import OrderedDict
+
+class ProgressStreams:
+    """Training progress events per job, for live subscribers and late joiners.
+
+    Each job keeps its full event history (training emits at most a few
+    thousand events), so a subscriber that connects late or reconnects with a
+    Last-Event-ID replays what it missed. Finished jobs are kept until more
+    than max_finished_jobs have finished after them.
+    """
+
+    def __init__(self, max_finished_jobs=100):
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs = {}  # job id -> {"node": name, "events": [...], "closed": bool}
+        self.finished = OrderedDict()  # job id -> None, oldest first
+        self.condition = threading.Condition()
+
+    def open(self, job_id, node_name):
+        with self.condition:
+            self.jobs[job_id] = {"node": node_name, "events": [], "closed": False}
+
+    def publish(self, job_id, event, close=False):
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None or job["closed"]:
+                return False
+            job["events"].append(event)
+            if close:
+                job["closed"] = True
+                self.finished[job_id] = None
+                while len(self.finished) > self.max_finished_jobs:
+                    self.jobs.pop(self.finished.popitem(last=False)[0], None)
+            self.condition.notify_all()
+            return True
+
+    def __contains__(self, job_id):
+        return job_id in self.jobs
+
+    def subscribe(self, job_id, start=0, keepalive_seconds=15):
+        """Yields (index, event) from start onwards, and None after keepalive_seconds without one.
+
+        Returns once the job is closed and every event has been yielded.
+        """
+        index = start
+        while True:
+            with self.condition:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    return
+                deadline = time.monotonic() + keepalive_seconds
+                while index >= len(job["events"]) and not job["closed"]:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                events = job["events"][index:]
+                closed = job["closed"]
+            if not events:
+                if closed:
+                    return
+                yield None
+                continue
+            for event in events:
+                yield index, event
+                index += 1
@@ -0,0 +1,107 @@
+# registry.py
+
+import threading
+
+class NodeRegistry:
+    """Connected nodes by name, plus a model name -> node names index.
+
+    Node entries are dicts (socket, name, host, port, models, model_hashes,
+    model_cache) that are never modified once stored: every update stores a
+    new dict under the lock. Readers can therefore use the entries they get
+    without locking and never see a half-applied update.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nodes = {}        # name -> node entry
+        self.model_index = {}  # model name -> set of node names
+
+    def register(self, node):
+        """Adds node, replacing any entry with the same name."""
+        with self.lock:
+            self._unindex(self.nodes.get(node["name"]))
+            self.nodes[node["name"]] = node
+            self._index(node)
+
+    def remove(self, node_name, client_socket=None):
+        """Removes node_name, but only if it is still client_socket's entry when one is given.
+
+        Returns the removed entry or None.
+        """
+        with self.lock:
+            node = self.nodes.get(node_name)
+            if node is None or (client_socket is not None and node.get("socket") is not client_socket):
+                return None
+            del self.nodes[node_name]
+            self._unindex(node)
+            return node
+
+    def get(self, node_name):
+        return self.nodes.get(node_name)
+
+    def with_model(self, model_name):
+        with self.lock:
+            return [self.nodes[name] for name in self.model_index.get(model_name, ())]
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.nodes.values())
+
+    def update_models(self, node_name, models, model_hashes=None):
+        """Replaces a node's model list; unknown nodes are ignored. Returns whether the node exists."""
+        changes = {"models": list(models)}
+        if model_hashes is not None:
+            changes["model_hashes"] = dict(model_hashes)
+        return self._update(node_name, changes)
+
+    def add_model(self, node_name, model_name, weights_hash=None):
+        with self.lock:
+            node = self.nodes.get(node_name)
+            if node is None:
+                return False
+            changes = {}
+            if model_name not in node.get("models", []):
+                changes["models"] = node.get("models", []) + [model_name]
+            if weights_hash:
+                changes["model_hashes"] = {**node.get("model_hashes", {}), model_name: weights_hash}
+            self._replace(node, changes)
+            return True
+
+    def update_model_cache(self, node_name, stats):
+        return self._update(node_name, {"model_cache": stats})
+
+    def update(self, node_name, **fields):
+        """Sets arbitrary node fields; unknown nodes are ignored."""
+        return self._update(node_name, fields)
+
+    def _update(self, node_name, changes):
+        with self.lock:
+            node = self.nodes.get(node_name)
+            if node is None:
+                return False
+            self._replace(node, changes)
+            return True
+
+    def _replace(self, node, changes):
+        updated = {**node, **changes}
+        if "models" in changes:
+            self._unindex(node)
+            self._index(updated)
+        self.nodes[node["name"]] = updated
+
+    def _index(self, node):
+        for model_name in node.get("models", []):
+            self.model_index.setdefault(model_name, set()).add(node["name"])
+
+    def _unindex(self, node):
+        if node is None:
+            return
+        for model_name in node.get("models", []):
+            names = self.model_index.get(model_name)
+            if names is not None:
+                names.discard(node["name"])
+                if not names:
+                    del self.model_index[model_name]
+
+    def __len__(self):
+        return len(self.nodes)
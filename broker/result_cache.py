@@ -0,0 +1,73 @@
+# result_cache.py
+
+import json
+import threading
+from collections import OrderedDict
+
+class ResultCache:
+    """Keeps inference responses for repeat requests, least recently used first out.
+
+    Entries are keyed by (model name, weights hash, precision, image hash),
+    so a result is only reused for the exact same weights, requested precision
+    and image bytes. Sizes are the
+    length of the JSON-encoded result; once the total exceeds the memory
+    budget, the least recently used results are evicted.
+    """
+
+    def __init__(self, memory_budget_bytes):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.results = OrderedDict()  # (model_name, weights_hash, precision, image_hash) -> (result, size_bytes)
+        self.lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.results.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.results.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result):
+        size = len(json.dumps(result))
+        with self.lock:
+            if key in self.results:
+                self._remove(key)
+            if size > self.memory_budget_bytes:
+                return
+            self.results[key] = (result, size)
+            self.total_bytes += size
+            while self.total_bytes > self.memory_budget_bytes:
+                self._remove(next(iter(self.results)))
+                self.evictions += 1
+
+    def invalidate(self, model_name):
+        """Drops every result for model_name, e.g. after it was retrained."""
+        with self.lock:
+            for key in [k for k in self.results if k[0] == model_name]:
+                self._remove(key)
+                self.invalidations += 1
+
+    def _remove(self, key):
+        _, size = self.results.pop(key)
+        self.total_bytes -= size
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self.results),
+                "memory_bytes": self.total_bytes,
+                "memory_budget_bytes": self.memory_budget_bytes
+            }
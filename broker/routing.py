@@ -0,0 +1,77 @@
+# routing.py
+
+import random
+import threading
+import time
+
+def cpu_pressure(node):
+    """Load average per CPU from the node's last heartbeat, at least 1."""
+    capacity = node.get("capacity") or {}
+    load, cpus = capacity.get("load_average"), capacity.get("cpu_count")
+    if not load or not cpus:
+        return 1.0
+    return max(load / cpus, 1.0)
+
+class Router:
+    """Picks a node for a request using power-of-two-choices.
+
+    Two random candidates are compared on (in-flight requests + 1) times their
+    recent latency (an exponentially weighted moving average), and the cheaper
+    one wins. Nodes without a latency sample yet look as fast as the fastest
+    known node so they get tried. A node whose last heartbeat reported more
+    runnable processes than CPUs (e.g. while it trains) costs proportionally
+    more, since its next request will be slower than its recent ones.
+    """
+
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self.inflight = {}
+        self.latency = {}
+        self.lock = threading.Lock()
+
+    def _cost(self, node, default_latency):
+        latency = self.latency.get(node["name"], default_latency)
+        return (self.inflight.get(node["name"], 0) + 1) * latency * cpu_pressure(node)
+
+    def choose(self, nodes):
+        if not nodes:
+            return None
+        if len(nodes) == 1:
+            return nodes[0]
+        with self.lock:
+            default_latency = min(self.latency.values(), default=0.001)
+            first, second = random.sample(nodes, 2)
+            if self._cost(first, default_latency) <= self._cost(second, default_latency):
+                return first
+            return second
+
+    def start(self, node_name):
+        with self.lock:
+            self.inflight[node_name] = self.inflight.get(node_name, 0) + 1
+        return time.perf_counter()
+
+    def finish(self, node_name, started, items=1):
+        """Records a completed (or timed out) request that start() returned started for.
+
+        Returns the request's elapsed seconds.
+        """
+        elapsed = time.perf_counter() - started
+        latency = elapsed / max(items, 1)
+        with self.lock:
+            self.inflight[node_name] = max(self.inflight.get(node_name, 1) - 1, 0)
+            previous = self.latency.get(node_name)
+            self.latency[node_name] = latency if previous is None else self.alpha * latency + (1 - self.alpha) * previous
+        return elapsed
+
+    def forget(self, node_name):
+        with self.lock:
+            self.inflight.pop(node_name, None)
+            self.latency.pop(node_name, None)
+
+    def stats(self, node_name):
+        with self.lock:
+            latency = self.latency.get(node_name)
+            return {
+                "inflight": self.inflight.get(node_name, 0),
+                "latency_ms": round(latency * 1000, 2) if latency is not None else None
+            }
@@ -1,18 +1,36 @@
 # state.py
 
+import itertools
 import os
+from jobs import JobScheduler
+from pending import PendingResponses
+from progress import ProgressStreams
+from registry import NodeRegistry
+from result_cache import ResultCache
+from routing import Router
 
 HOST = os.getenv("HOST", "0.0.0.0")
 SERVER_PORT = int(os.getenv("SERVER_PORT", 8000))
 API_PORT = int(os.getenv("API_PORT", 8001))
+MAX_BATCH_IMAGES = int(os.getenv("MAX_BATCH_IMAGES", 1000))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 32 * 1024 * 1024))
+RESULT_CACHE_MB = int(os.getenv("RESULT_CACHE_MB", 64))
+MAX_TRAININGS_PER_NODE = int(os.getenv("MAX_TRAININGS_PER_NODE", 1))
+HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT", 30))
+DIST_PORT_BASE = int(os.getenv("DIST_PORT_BASE", 29500))
+DIST_PORT_COUNT = int(os.getenv("DIST_PORT_COUNT", 100))
 
-nodes = []
-json_responses = {}
+registry = NodeRegistry()
+json_responses = PendingResponses()
+training_progress = ProgressStreams()
+jobs = JobScheduler(registry, training_progress, MAX_TRAININGS_PER_NODE)
+router = Router()
+result_cache = ResultCache(RESULT_CACHE_MB * 1024 * 1024)
 client_socket = None
+client_loop = None
+eviction_task = None
+dist_port_counter = itertools.count()
 
-def update_node_models(node_name, models):
-    for node in nodes:
-        if node["name"] == node_name:
-            node["models"] = models
-            return
-    nodes.append({"name": node_name, "models": models})
+def next_master_port():
+    # rotate so concurrent distributed jobs get their own rendezvous port
+    return DIST_PORT_BASE + next(dist_port_counter) % DIST_PORT_COUNT
@@ -0,0 +1,14 @@
+# telemetry.py
+#
+# The broker's own metrics, served with the nodes' pushed ones on /metrics.
+
+from metrics import Registry
+
+registry = Registry()
+http_requests = registry.counter("broker_http_requests_total", "HTTP requests by endpoint, method and status")
+http_latency = registry.histogram("broker_http_request_duration_seconds", "HTTP request latency by endpoint")
+http_in_flight = registry.gauge("broker_http_requests_in_flight", "HTTP requests being handled, by endpoint")
+node_latency = registry.histogram("broker_node_request_duration_seconds", "Broker to node round trip latency by node and kind")
+socket_bytes = registry.counter("broker_socket_bytes_total", "Bytes read from and written to node connections")
+messages = registry.counter("broker_messages_total", "Node protocol messages by direction and type")
+training_throughput = registry.gauge("broker_training_images_per_second", "Latest training throughput reported for a model")
@@ -1,14 +1,28 @@
 # utils.py
 
-import json
+import telemetry
+from protocol import encode_frame, ENCODING_JSON
 
 def log_message(action, target, message):
     print(f"[LOG] Action: {action}, Target: {target}, Message: {message}")
 
-def send_json_message(client_socket, response, target_name=None):
+def summarize(message):
+    """Copy of message for logging, with bytes values replaced by their size."""
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        return f"<{len(message)} bytes>"
+    if isinstance(message, dict):
+        return {key: summarize(value) for key, value in message.items()}
+    if isinstance(message, list):
+        return [summarize(value) for value in message]
+    return message
+
+def send_json_message(client_socket, response, target_name=None, encoding=None, quiet=False):
     try:
-        message = json.dumps(response) + '\n'  # Add newline delimiter
-        client_socket.sendall(message.encode())
-        log_message("SEND", target_name or "Unknown", response)
+        if encoding is None:
+            encoding = getattr(client_socket, "encoding", ENCODING_JSON)  # reply in the node's own encoding
+        client_socket.sendall(encode_frame(response, encoding))
+        telemetry.messages.inc(direction="out", type=response.get("type", "unknown"))
+        if not quiet:
+            log_message("SEND", target_name or "Unknown", summarize(response))
     except Exception as e:
         print(f"Error sending message: {e}")
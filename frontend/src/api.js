@@ -4,14 +4,26 @@ const BASE_URL = "http://192.168.8.125:8001";
 export const getNodes = async () => await axios.get(`${BASE_URL}/nodes`);
 export const getImages = async () => await axios.get(`${BASE_URL}/images`);
 export const trainModel = async (data) => {
+    let jobId;
     try {
       const response = await axios.post(`${BASE_URL}/train`, data, {
         headers: { "Content-Type": "application/json" },
       });
-      return response.data;
+      jobId = response.data.job;
     } catch (error) {
       throw error.response?.data || error.message;
     }
+    // training runs as a queued job on the broker; poll it until it finishes
+    for (;;) {
+      const job = (await axios.get(`${BASE_URL}/jobs/${encodeURIComponent(jobId)}`)).data;
+      if (job.status === "completed") {
+        return job.result;
+      }
+      if (job.status === "failed" || job.status === "cancelled") {
+        throw new Error(job.error || `Training ${job.status}`);
+      }
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+    }
   };
   
 export const runInference = async (data) => {
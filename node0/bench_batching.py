@@ -0,0 +1,85 @@
+# bench_batching.py
+#
+# Measures inference throughput and latency with and without micro-batching.
+# --clients threads each send requests back to back for --duration seconds
+# using random 224x224 inputs and an untrained model, so no dataset or
+# trained weights are needed. "unbatched" is the old behaviour: every request
+# runs its own batch-of-one forward pass on its own thread.
+#
+#   python3 bench_batching.py --base-model mobilenet --clients 16 --windows 0,1,2,5,10,20
+
+import argparse
+import json
+import threading
+import time
+
+import torch
+
+import inference
+import train
+from batcher import MicroBatcher
+
+CLASS_NAMES = ["chicken", "cow", "dog"]
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def run(model, clients, duration, batcher=None):
+    latencies = []
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client():
+        image = torch.randn(1, 3, 224, 224)
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            if batcher is None:
+                inference.predict_batch(image, model, CLASS_NAMES)
+            else:
+                done = threading.Event()
+                batcher.submit("bench", model, CLASS_NAMES, image, lambda prediction, error: done.set())
+                done.wait()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "throughput_per_second": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark micro-batched inference.")
+    parser.add_argument("--base-model", choices=["mobilenet", "efficientnet", "resnet"], default="mobilenet")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent clients sending requests")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per configuration")
+    parser.add_argument("--windows", default="0,1,2,5,10,20", help="Comma separated batch windows in ms")
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--output", help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    model = train.get_model(args.base_model, len(CLASS_NAMES), pretrained=False).eval()
+    with torch.no_grad():
+        model(torch.randn(1, 3, 224, 224))  # warm up
+
+    results = [{"mode": "unbatched", **run(model, args.clients, args.duration)}]
+    for window in [float(w) for w in args.windows.split(",")]:
+        batcher = MicroBatcher(window, args.max_batch_size)
+        results.append({"mode": f"window={window:g}ms", **run(model, args.clients, args.duration, batcher)})
+
+    print(f"{args.base_model}, {args.clients} clients, max batch {args.max_batch_size}, {torch.get_num_threads()} threads")
+    print(f"{'mode':<16}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for result in results:
+        print(f"{result['mode']:<16}{result['throughput_per_second']:>10}{result['p50_ms']:>10}{result['p99_ms']:>10}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"base_model": args.base_model, "clients": args.clients, "results": results}, f, indent=4)
@@ -0,0 +1,166 @@
+# cpu_budget.py
+#
+# Splits a node's CPU budget (a core set or a thread count) between its
+# training subprocesses and its in-process inference, so several nodes and
+# jobs on one host do not each start a thread per core.
+
+import os
+import threading
+
+import torch
+
+def parse_cpu_list(value):
+    """Parses the Linux cpuset list format, e.g. "0-3,6" -> [0, 1, 2, 3, 6]."""
+    cpus = set()
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    if not cpus:
+        raise ValueError(f"Empty CPU list '{value}'")
+    return sorted(cpus)
+
+def format_cpu_list(cpus):
+    return ",".join(map(str, cpus))
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def apply_cpu_limits(cpus=None, threads=None, interop_threads=None):
+    """Pins the calling thread (and the threads it starts later) to cpus, and sizes torch's thread pools.
+
+    Call it before torch runs anything parallel: the inter-op pool can only
+    be sized once, and worker threads inherit their creator's affinity.
+    """
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    threads = threads or (len(cpus) if cpus else None)
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            pass  # already set, or inter-op work has already started
+
+def pin_process(cpus):
+    """Pins every thread of this process to cpus; threads started later inherit their creator's affinity.
+
+    sched_setaffinity(0, ...) only moves the calling thread, and torch's
+    worker threads keep the affinity they were created with, so each thread
+    listed in /proc/self/task is moved on its own.
+    """
+    try:
+        thread_ids = [int(tid) for tid in os.listdir("/proc/self/task")]
+    except OSError:
+        thread_ids = [0]
+    for thread_id in thread_ids:
+        try:
+            os.sched_setaffinity(thread_id, cpus)
+        except OSError:
+            pass  # the thread exited in the meantime
+
+class CpuBudget:
+    """A node's CPUs: one fixed share per training slot, the rest for inference.
+
+    With a core set, the last inference_cpus cores are kept for inference and
+    the other cores are divided between the max_trainings slots (the last slot
+    also takes the remainder of an uneven split), and each training job is
+    pinned to its slot's cores. Inference runs in the node process, which is
+    pinned to every core no running training holds, so it never shares a core
+    with a training. With only a thread count the same split is made on
+    counts and nothing is pinned: inference is then limited in threads only.
+    """
+
+    def __init__(self, cpus=None, threads=None, max_trainings=1, inference_cpus=1):
+        self.cpus = cpus
+        self.total = len(cpus) if cpus else (threads or len(available_cpus()))
+        self.inference_reserved = max(1, min(inference_cpus, self.total))
+        training_total = self.total - self.inference_reserved
+        if training_total < max_trainings:
+            training_total = self.total  # too few CPUs to keep any apart; training shares them with inference
+        per_slot = max(1, training_total // max_trainings)
+        remainder = max(0, training_total - per_slot * max_trainings)
+        self.slots = []
+        for slot in range(max_trainings):
+            threads = per_slot + (remainder if slot == max_trainings - 1 else 0)
+            slot_cpus = None
+            if cpus:
+                start = (slot * per_slot) % training_total
+                slot_cpus = cpus[start:start + threads]
+            self.slots.append({"slot": slot, "cpus": slot_cpus, "threads": threads})
+        self.free = list(range(max_trainings))
+        self.running = {}  # train_key -> slot allocation
+        self.pinned_cpus = None  # the cores the node process was last pinned to
+        self.condition = threading.Condition()
+
+    def acquire(self, train_key):
+        """Blocks until a training slot is free and returns its allocation."""
+        with self.condition:
+            while not self.free:
+                self.condition.wait()
+            allocation = self.slots[self.free.pop(0)]
+            self.running[train_key] = allocation
+        return allocation
+
+    def release(self, train_key):
+        with self.condition:
+            allocation = self.running.pop(train_key, None)
+            if allocation is not None:
+                self.free.append(allocation["slot"])
+                self.free.sort()
+                self.condition.notify()
+
+    def inference_cpus(self):
+        """The cores no running training holds (never fewer than the reserved ones), or None without a core set."""
+        if not self.cpus:
+            return None
+        with self.condition:
+            held = {cpu for allocation in self.running.values() for cpu in allocation["cpus"]}
+        free = [cpu for cpu in self.cpus if cpu not in held]
+        if len(free) < self.inference_reserved:
+            return self.cpus[-self.inference_reserved:]
+        return free
+
+    def inference_threads(self):
+        if self.cpus:
+            return len(self.inference_cpus())
+        with self.condition:
+            used = sum(allocation["threads"] for allocation in self.running.values())
+        return max(self.inference_reserved, self.total - used)
+
+    def apply_inference_threads(self):
+        """Pins the node process to the current inference cores and sizes the calling thread's torch pool to match.
+
+        Call it before each inference forward pass: once a thread has run a
+        torch op, torch.set_num_threads only affects that thread. The process
+        is only re-pinned when the inference cores changed since the last call.
+        """
+        cpus = self.inference_cpus()
+        if cpus and hasattr(os, "sched_setaffinity"):
+            with self.condition:
+                if cpus != self.pinned_cpus:
+                    pin_process(cpus)
+                    self.pinned_cpus = cpus
+        threads = len(cpus) if cpus else self.inference_threads()
+        if torch.get_num_threads() != threads:
+            torch.set_num_threads(threads)
+
+    def snapshot(self):
+        with self.condition:
+            running = {key: {"cpus": a["cpus"], "threads": a["threads"]} for key, a in self.running.items()}
+        return {
+            "cpus": self.cpus,
+            "threads": self.total,
+            "inference_cpus": self.inference_cpus(),
+            "inference_threads": self.inference_threads(),
+            "inference_reserved": self.inference_reserved,
+            "trainings": running
+        }
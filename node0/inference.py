@@ -1,10 +1,76 @@
 import torch
 import torch.nn as nn
+from cpu_budget import apply_cpu_limits, parse_cpu_list
+import profiling
 from torchvision import models, transforms
 from PIL import Image
 import argparse
+import contextlib
+import io
 import json
 import datetime
+import os
+import statistics
+import time
+
+PRECISIONS = ["fp32", "bf16"]
+
+def bf16_supported(device_type="cpu"):
+    if device_type == "cuda":
+        return torch.cuda.is_bf16_supported()
+    # without AVX512-BF16 (or AMX) bf16 matmuls are emulated on the CPU and slower than fp32
+    is_supported = getattr(torch.cpu, "_is_avx512_bf16_supported", None)
+    return bool(is_supported and is_supported())
+
+def resolve_precision(precision, model=None, device_type="cpu"):
+    """The precision a forward pass actually runs at.
+
+    bf16 falls back to fp32 on hardware without native bf16, and for
+    TorchScript modules, whose frozen graphs autocast does not rewrite.
+    """
+    if precision != "bf16" or not bf16_supported(device_type) or isinstance(model, torch.jit.ScriptModule):
+        return "fp32"
+    return "bf16"
+
+def autocast(precision, device_type="cpu"):
+    if precision == "bf16":
+        return torch.autocast(device_type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+class ChannelsLastInput(nn.Module):
+    """Runs a channels_last model on NCHW batches by converting them first."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, images):
+        return self.model(images.contiguous(memory_format=torch.channels_last))
+
+def enable_compile_cache(cache_dir):
+    """Keeps Inductor's compiled kernels and FX graphs in cache_dir, so later runs skip most of the compilation."""
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = os.path.abspath(cache_dir)
+
+def prepare_model(model, channels_last=False, compile_model=False, compile_cache_dir=None, warmup_batch_sizes=(1, 2)):
+    """Applies the opt-in execution modes to a loaded eager model; TorchScript modules are returned as they are.
+
+    A compiled model is run once per warm-up batch size here: the first call
+    compiles, the second batch size makes the batch dimension dynamic, so
+    later batches of any size do not recompile.
+    """
+    if isinstance(model, torch.jit.ScriptModule):
+        return model
+    if channels_last:
+        model = ChannelsLastInput(model.to(memory_format=torch.channels_last))
+    if compile_model:
+        if compile_cache_dir:
+            enable_compile_cache(compile_cache_dir)
+        model = torch.compile(model)
+        with torch.no_grad():
+            for batch_size in warmup_batch_sizes:
+                model(torch.zeros(batch_size, 3, 224, 224))
+    return model
 
 def get_model(base_model, num_classes, model_path):
     if base_model == "mobilenet":
@@ -23,53 +89,138 @@ def get_model(base_model, num_classes, model_path):
     model.eval()
     return model
 
-def preprocess_image(image_path):
+def torchscript_path_for(model_path):
+    return os.path.splitext(model_path)[0] + ".torchscript.pt"
+
+def export_torchscript(model, path):
+    """Traces and freezes the model (weights become constants, conv+batchnorm are folded) and saves it to path."""
+    model.eval()
+    with torch.no_grad():
+        frozen = torch.jit.freeze(torch.jit.trace(model, torch.randn(1, 3, 224, 224)))
+    torch.jit.save(frozen, path)
+    return frozen
+
+def load_torchscript(path, warmup_runs=2):
+    """Loads an exported artifact and applies optimize_for_inference; no torchvision model builder is involved.
+
+    optimize_for_inference runs here rather than at export because the
+    MKL-DNN constants it may create cannot be serialized. The first calls of
+    a scripted module run the JIT's profiling passes, so they are done here
+    rather than on the first request.
+    """
+    model = torch.jit.optimize_for_inference(torch.jit.load(path, map_location=torch.device("cpu")))
+    with torch.no_grad():
+        for _ in range(warmup_runs):
+            model(torch.zeros(1, 3, 224, 224))
+    return model
+
+def load_model(base_model, num_classes, model_path, torchscript_path=None):
+    """The TorchScript artifact if one was exported, otherwise the eager model rebuilt from the .pth."""
+    if torchscript_path and os.path.exists(torchscript_path):
+        return load_torchscript(torchscript_path)
+    return get_model(base_model, num_classes, model_path)
+
+def measure_latency(model, batch_size=1, runs=20, warmup_runs=3):
+    """Median seconds per forward pass over random inputs."""
+    images = torch.randn(batch_size, 3, 224, 224)
+    timings = []
+    with torch.no_grad():
+        for i in range(warmup_runs + runs):
+            start = time.perf_counter()
+            model(images)
+            if i >= warmup_runs:
+                timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def preprocess_image(image_source):
+    """image_source is a file path, or the encoded image file itself as a bytes-like object."""
     transform = transforms.Compose([
         transforms.Resize((224, 224)),
         transforms.ToTensor(),
         transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
     ])
-    image = Image.open(image_path).convert("RGB")
+    if isinstance(image_source, (bytes, bytearray, memoryview)):
+        image_source = io.BytesIO(image_source)
+    image = Image.open(image_source).convert("RGB")
     return transform(image).unsqueeze(0)
 
-def predict(image_path, model, class_names):
-    image = preprocess_image(image_path)
+def predict(image_path, model, class_names, precision="fp32", profiler=None):
+    with profiling.stage(profiler, "preprocess"):
+        image = preprocess_image(image_path)
+    return predict_batch(image, model, class_names, precision, profiler)[0]
+
+def predict_batch(images, model, class_names, precision="fp32", profiler=None):
+    """Runs one forward pass over a (N, 3, 224, 224) batch and returns a (predicted_class, results) pair per image.
+
+    precision should already be resolved with resolve_precision. profiler, a
+    profiling.Profiler, times the forward and postprocess stages.
+    """
     with torch.no_grad():
-        outputs = model(image)
-        probabilities = torch.nn.functional.softmax(outputs, dim=1)[0]
-        predicted_index = torch.argmax(probabilities).item()
-        predicted_class = class_names[predicted_index]
+        with profiling.stage(profiler, "forward"):
+            with autocast(precision):
+                outputs = model(images)
+        with profiling.stage(profiler, "postprocess"):
+            probabilities = torch.nn.functional.softmax(outputs.float(), dim=1).tolist()
 
-        results = [(class_names[i], prob.item()) for i, prob in enumerate(probabilities)]
-        results.sort(key=lambda x: x[1], reverse=True)
+    predictions = []
+    for row in probabilities:
+        results = sorted(zip(class_names, row), key=lambda x: x[1], reverse=True)
+        predictions.append((results[0][0], results))
+    return predictions
 
-    return predicted_class, results
+def load_class_names(class_names_path):
+    with open(class_names_path, "r") as f:
+        return [line.strip() for line in f]
 
-def generate_report(report_path, args, image_path, prediction, results):
+def build_report(arguments, image_path, prediction, results, profile=None):
     report = {
         "timestamp": datetime.datetime.now().isoformat(),
-        "arguments": vars(args),
+        "arguments": arguments,
         "image": image_path,
         "predicted_class": prediction,
         "output": results
     }
+    if profile:
+        report["profile"] = profile
+    return report
+
+def generate_report(report_path, arguments, image_path, prediction, results, profile=None):
+    report = build_report(arguments, image_path, prediction, results, profile)
     with open(report_path, 'w') as f:
         json.dump(report, f, indent=4)
 
-def main(image_path, model_path, base_model, class_names_path, report_path=None):
-    with open(class_names_path, "r") as f:
-        class_names = [line.strip() for line in f]
-
-    model = get_model(base_model, len(class_names), model_path)
-    predicted_class, results = predict(image_path, model, class_names)
+def main(image_path, model_path, base_model, class_names_path, report_path=None, torchscript_path=None, precision="fp32",
+         channels_last=False, compile_model=False, compile_cache_dir=None, profile=False, profile_trace=None):
+    profiler = profiling.Profiler(trace_path=profile_trace) if profile or profile_trace else None
+    with profiler or contextlib.nullcontext():
+        class_names = load_class_names(class_names_path)
+        with profiling.stage(profiler, "load"):
+            model = load_model(base_model, len(class_names), model_path, torchscript_path)
+            model = prepare_model(model, channels_last, compile_model, compile_cache_dir, warmup_batch_sizes=(1,))
+        precision = resolve_precision(precision, model)
+        predicted_class, results = predict(image_path, model, class_names, precision, profiler)
 
     print(f"Predicted Class: {predicted_class}")
     print("Class Probabilities:")
     for class_name, probability in results:
         print(f"{class_name}: {probability:.2%}")
+    if profiler:
+        print(f"Stage times: {profiling.format_summary(profiler.summary())}")
 
     if report_path:
-        generate_report(report_path, args, image_path, predicted_class, results)
+        arguments = {
+            "image_path": image_path,
+            "model_path": model_path,
+            "base_model": base_model,
+            "class_names_path": class_names_path,
+            "torchscript_path": torchscript_path,
+            "precision": precision,
+            "channels_last": channels_last,
+            "compile": compile_model,
+            "report": report_path
+        }
+        generate_report(report_path, arguments, image_path, predicted_class, results,
+                        profiler.summary() if profiler else None)
         print(f"Report saved to {report_path}")
 
 if __name__ == "__main__":
@@ -79,6 +230,18 @@ if __name__ == "__main__":
     parser.add_argument("--base-model", type=str, choices=["mobilenet", "efficientnet", "resnet"], required=True, help="Base model architecture used during training")
     parser.add_argument("--class-names-path", type=str, required=True, help="Path to the text file with class names (one per line)")
     parser.add_argument("--report", type=str, help="Path to save the JSON report")
+    parser.add_argument("--torchscript-path", type=str, help="Exported TorchScript artifact to use instead of rebuilding the model from the .pth")
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32", help="bf16 runs the forward pass under CPU autocast where the hardware supports it")
+    parser.add_argument("--num-threads", type=int, help="torch intra-op threads (default: torch's choice, one per core)")
+    parser.add_argument("--cpus", type=parse_cpu_list, help="Pin inference to these cores, e.g. 0-3")
+    parser.add_argument("--channels-last", action="store_true", help="Run the model and its input in channels_last memory format")
+    parser.add_argument("--compile", action="store_true", help="Compile the model with torch.compile")
+    parser.add_argument("--compile-cache-dir", type=str, help="Directory that keeps compiled kernels across runs")
+    parser.add_argument("--profile", action="store_true", help="Record per-stage wall time (load, preprocess, forward, postprocess) in the report")
+    parser.add_argument("--profile-trace", type=str, help="Also write a torch.profiler Chrome trace of the run to this path")
     args = parser.parse_args()
 
-    main(args.image_path, args.model_path, args.base_model, args.class_names_path, args.report)
+    if args.num_threads or args.cpus:
+        apply_cpu_limits(args.cpus, args.num_threads, interop_threads=1)
+    main(args.image_path, args.model_path, args.base_model, args.class_names_path, args.report, args.torchscript_path, args.precision,
+         args.channels_last, args.compile, args.compile_cache_dir, args.profile, args.profile_trace)
@@ -0,0 +1,116 @@
+# profiling.py
+#
+# --profile support for train.py, inference.py and the node client. A
+# Profiler adds up wall time per named stage (data wait, H2D copy, forward,
+# backward, ...) for the report, and can also record a torch.profiler trace
+# in Chrome trace format (viewable in Perfetto or chrome://tracing), with
+# every stage marked as a named range.
+
+import contextlib
+import os
+import re
+import time
+
+import torch
+from torch.profiler import ProfilerActivity, profile, record_function, schedule
+
+PROFILES_DIR = "profiles"
+TRACE_ID = re.compile(r"^[\w-][\w.-]*$")
+
+def trace_path_for(trace_id):
+    """Where the node keeps the trace with this id; ids are validated, since they come in over the network."""
+    if not TRACE_ID.match(trace_id or ""):
+        raise ValueError(f"Invalid trace id '{trace_id}'")
+    return os.path.join(PROFILES_DIR, f"{trace_id}.trace.json")
+
+class Profiler:
+    """Per-stage wall times, plus an optional torch.profiler trace written to trace_path.
+
+    On CUDA every stage boundary synchronizes, so asynchronous kernels are
+    charged to the stage that launched them; that costs some throughput,
+    which is why profiling is opt-in. With trace_steps, the trace warms up on
+    the first step and keeps the next trace_steps ones (call step() after
+    each), so a long training run does not produce a huge trace; without it
+    the whole run is recorded.
+    """
+
+    def __init__(self, device_type="cpu", trace_path=None, trace_steps=None):
+        self.seconds = {}
+        self.calls = {}
+        self.sync = torch.cuda.synchronize if device_type == "cuda" else None
+        self.trace_path = trace_path
+        self.trace = None
+        if trace_path:
+            os.makedirs(os.path.dirname(os.path.abspath(trace_path)), exist_ok=True)
+            activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if device_type == "cuda" else [])
+            self.trace = profile(
+                activities=activities,
+                schedule=schedule(wait=0, warmup=1, active=trace_steps, repeat=1) if trace_steps else None,
+                on_trace_ready=lambda trace: trace.export_chrome_trace(trace_path),
+                record_shapes=True
+            )
+
+    def start(self):
+        if self.trace:
+            self.trace.start()
+
+    def stop(self):
+        if self.trace:
+            self.trace.stop()  # writes the trace, also when the run ended within the window
+            self.trace = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.sync:
+            self.sync()
+        start = time.perf_counter()
+        try:
+            if self.trace:
+                with record_function(name):
+                    yield
+            else:
+                yield
+        finally:
+            if self.sync:
+                self.sync()
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def step(self):
+        if self.trace and self.trace.schedule is not None:
+            self.trace.step()
+
+    def since(self, earlier):
+        """Seconds per stage added after earlier, a copy of self.seconds taken before."""
+        return {name: seconds - earlier.get(name, 0.0) for name, seconds in self.seconds.items()}
+
+    def summary(self):
+        total = sum(self.seconds.values())
+        return {
+            "stages": {name: {
+                "seconds": round(seconds, 4),
+                "calls": self.calls[name],
+                "fraction": round(seconds / total, 4) if total else 0.0
+            } for name, seconds in self.seconds.items()},
+            "total_seconds": round(total, 4),
+            "trace_path": self.trace_path
+        }
+
+def stage(profiler, name):
+    """profiler.stage(name), or a no-op when profiling is off."""
+    return profiler.stage(name) if profiler else contextlib.nullcontext()
+
+def format_summary(summary):
+    """One line, slowest stage first: "forward 1.20 s (40%), backward ..."."""
+    stages = sorted(summary["stages"].items(), key=lambda item: item[1]["seconds"], reverse=True)
+    return ", ".join(f"{name} {stage['seconds']:.2f} s ({stage['fraction']:.0%})" for name, stage in stages)
@@ -0,0 +1,203 @@
+# protocol.py
+#
+# Wire format shared by the broker and the nodes. Every message is one frame:
+#
+#   +---------+----------+----------------+-----------------+
+#   | version | encoding | payload length | payload         |
+#   | 1 byte  | 1 byte   | 4 bytes (BE)   | length bytes    |
+#   +---------+----------+----------------+-----------------+
+#
+# The encoding byte selects the codec used for the payload, so each frame can
+# be decoded on its own and a peer can mix encodings on one connection.
+# Keep this file identical in broker/ and every node directory.
+
+import json
+import struct
+
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct("!BBI")
+MAX_FRAME_BYTES = 256 * 1024 * 1024
+
+ENCODING_JSON = 0
+ENCODING_BINARY = 1
+
+class ProtocolError(Exception):
+    pass
+
+class JsonCodec:
+    def encode(self, message):
+        return json.dumps(message, separators=(",", ":")).encode()
+
+    def encode_chunks(self, message):
+        return [self.encode(message)]
+
+    def decode(self, payload):
+        return json.loads(bytes(payload))
+
+class BinaryCodec:
+    """Compact tagged encoding: one tag byte per value, fixed width numbers.
+
+    Besides the JSON types it carries raw bytes values without any base64
+    inflation; they decode as memoryviews over the received frame.
+    """
+
+    NONE, TRUE, FALSE, INT, BIGINT, FLOAT, STR, BYTES, LIST, MAP = b"NTFiIdsblm"
+    INT64 = struct.Struct("!q")
+    FLOAT64 = struct.Struct("!d")
+    LENGTH = struct.Struct("!I")
+
+    def encode(self, message):
+        return b"".join(self.encode_chunks(message))
+
+    def encode_chunks(self, message):
+        """Encoded payload as a list of chunks; bytes values are included as-is, not copied."""
+        chunks = []
+        self._encode(message, chunks)
+        return chunks
+
+    def _encode(self, value, chunks):
+        if value is None:
+            chunks.append(b"N")
+        elif value is True:
+            chunks.append(b"T")
+        elif value is False:
+            chunks.append(b"F")
+        elif isinstance(value, int):
+            if -2**63 <= value < 2**63:
+                chunks.append(b"i" + self.INT64.pack(value))
+            else:
+                self._encode_sized(b"I", str(value).encode(), chunks)
+        elif isinstance(value, float):
+            chunks.append(b"d" + self.FLOAT64.pack(value))
+        elif isinstance(value, str):
+            self._encode_sized(b"s", value.encode(), chunks)
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            self._encode_sized(b"b", value, chunks)
+        elif isinstance(value, (list, tuple)):
+            chunks.append(b"l" + self.LENGTH.pack(len(value)))
+            for item in value:
+                self._encode(item, chunks)
+        elif isinstance(value, dict):
+            chunks.append(b"m" + self.LENGTH.pack(len(value)))
+            for key, item in value.items():
+                self._encode(key, chunks)
+                self._encode(item, chunks)
+        else:
+            raise TypeError(f"Cannot encode value of type {type(value).__name__}")
+
+    def _encode_sized(self, tag, data, chunks):
+        chunks.append(tag + self.LENGTH.pack(len(data)))
+        chunks.append(data)
+
+    def decode(self, payload):
+        view = memoryview(payload)
+        value, offset = self._decode(view, 0)
+        if offset != len(view):
+            raise ProtocolError("Trailing bytes after binary payload")
+        return value
+
+    def _decode(self, view, offset):
+        try:
+            tag = view[offset]
+        except IndexError:
+            raise ProtocolError("Truncated binary payload")
+        offset += 1
+        if tag == self.NONE:
+            return None, offset
+        if tag == self.TRUE:
+            return True, offset
+        if tag == self.FALSE:
+            return False, offset
+        if tag == self.INT:
+            return self.INT64.unpack_from(view, offset)[0], offset + 8
+        if tag == self.FLOAT:
+            return self.FLOAT64.unpack_from(view, offset)[0], offset + 8
+        if tag in (self.BIGINT, self.STR, self.BYTES):
+            (length,) = self.LENGTH.unpack_from(view, offset)
+            offset += 4
+            data = view[offset:offset + length]
+            if len(data) != length:
+                raise ProtocolError("Truncated binary payload")
+            offset += length
+            if tag == self.BYTES:
+                return data, offset
+            if tag == self.STR:
+                return str(data, "utf-8"), offset
+            return int(str(data, "ascii")), offset
+        if tag == self.LIST:
+            (count,) = self.LENGTH.unpack_from(view, offset)
+            offset += 4
+            items = []
+            for _ in range(count):
+                item, offset = self._decode(view, offset)
+                items.append(item)
+            return items, offset
+        if tag == self.MAP:
+            (count,) = self.LENGTH.unpack_from(view, offset)
+            offset += 4
+            result = {}
+            for _ in range(count):
+                key, offset = self._decode(view, offset)
+                result[key], offset = self._decode(view, offset)
+            return result, offset
+        raise ProtocolError(f"Unknown binary tag {tag!r}")
+
+CODECS = {
+    ENCODING_JSON: JsonCodec(),
+    ENCODING_BINARY: BinaryCodec(),
+}
+
+ENCODING_NAMES = {
+    "json": ENCODING_JSON,
+    "binary": ENCODING_BINARY,
+}
+
+def encode_frame(message, encoding=ENCODING_JSON):
+    codec = CODECS.get(encoding)
+    if codec is None:
+        raise ProtocolError(f"Unknown payload encoding {encoding}")
+    chunks = codec.encode_chunks(message)
+    length = sum(len(chunk) for chunk in chunks)
+    if length > MAX_FRAME_BYTES:
+        raise ProtocolError(f"Frame of {length} bytes exceeds {MAX_FRAME_BYTES} bytes")
+    # a single join, so large bytes values are copied exactly once into the frame
+    return b"".join([HEADER.pack(PROTOCOL_VERSION, encoding, length), *chunks])
+
+class FrameDecoder:
+    """Reassembles frames from an arbitrary stream of received chunks.
+
+    feed() accepts whatever recv() returned and yields every message that is
+    now complete; partial frames stay buffered until the rest arrives.
+    """
+
+    def __init__(self, max_frame_bytes=MAX_FRAME_BYTES):
+        self.buffer = bytearray()
+        self.max_frame_bytes = max_frame_bytes
+        self.encoding = None  # encoding of the last frame received
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        offset = 0
+        while len(self.buffer) - offset >= HEADER.size:
+            version, encoding, length = HEADER.unpack_from(self.buffer, offset)
+            if version != PROTOCOL_VERSION:
+                raise ProtocolError(f"Unsupported protocol version {version}")
+            if length > self.max_frame_bytes:
+                raise ProtocolError(f"Frame of {length} bytes exceeds {self.max_frame_bytes} bytes")
+            codec = CODECS.get(encoding)
+            if codec is None:
+                raise ProtocolError(f"Unknown payload encoding {encoding}")
+            end = offset + HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            with memoryview(self.buffer) as view:
+                payload = bytes(view[offset + HEADER.size:end])  # one copy out of the receive buffer
+            offset = end
+            try:
+                messages.append(codec.decode(payload))
+            except (ValueError, struct.error) as e:
+                raise ProtocolError(f"Malformed payload: {e}")
+            self.encoding = encoding
+        del self.buffer[:offset]
+        return messages
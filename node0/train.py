@@ -3,9 +3,18 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
+import torch.distributed as dist
 from torchvision import datasets, models, transforms
-from torch.utils.data import DataLoader
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Subset
+from torch.utils.data.distributed import DistributedSampler
+from cpu_budget import apply_cpu_limits, parse_cpu_list
+from dataset_cache import CachedImageDataset
+import inference
+import profiling
+import quantization
 import argparse
+import copy
 import json
 import datetime
 import os
@@ -22,75 +31,205 @@ def round_floats(obj, precision=4):
     else:
         return obj
 
-def get_data_loaders(data_dir, batch_size=32):
-    train_transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.RandomHorizontalFlip(),
-        transforms.RandomRotation(10),
-        transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.2),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-    ])
-    test_transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-    ])
-    train_dataset = datasets.ImageFolder(root=f"{data_dir}/train", transform=train_transform)
-    test_dataset = datasets.ImageFolder(root=f"{data_dir}/test", transform=test_transform)
-    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
-    test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False)
+def loader_kwargs(num_workers=0, prefetch_factor=None, persistent_workers=False, pin_memory=False):
+    kwargs = {"num_workers": num_workers, "pin_memory": pin_memory}
+    if num_workers > 0:  # the other options are only valid with worker processes
+        kwargs["persistent_workers"] = persistent_workers
+        if prefetch_factor:
+            kwargs["prefetch_factor"] = prefetch_factor
+    return kwargs
+
+def get_data_loaders(data_dir, batch_size=32, world_size=1, rank=0, cache_dir=None, loader_options=None):
+    train_dataset, test_dataset = get_datasets(data_dir, cache_dir)
+    train_loader, test_loader = build_data_loaders(train_dataset, test_dataset, batch_size, world_size, rank, loader_options)
     return train_loader, test_loader, len(train_dataset.classes)
 
-def get_model(base_model, num_classes):
+def get_datasets(data_dir, cache_dir=None):
+    if cache_dir:
+        # images come out of the cache already decoded and resized
+        train_transform = transforms.Compose([
+            transforms.RandomHorizontalFlip(),
+            transforms.RandomRotation(10),
+            transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.2),
+            transforms.ToTensor(),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        ])
+        test_transform = transforms.Compose([
+            transforms.ToTensor(),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        ])
+        train_dataset = CachedImageDataset(f"{data_dir}/train", f"{cache_dir}/train", transform=train_transform)
+        test_dataset = CachedImageDataset(f"{data_dir}/test", f"{cache_dir}/test", transform=test_transform)
+    else:
+        train_transform = transforms.Compose([
+            transforms.Resize((224, 224)),
+            transforms.RandomHorizontalFlip(),
+            transforms.RandomRotation(10),
+            transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.2),
+            transforms.ToTensor(),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        ])
+        test_transform = transforms.Compose([
+            transforms.Resize((224, 224)),
+            transforms.ToTensor(),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        ])
+        train_dataset = datasets.ImageFolder(root=f"{data_dir}/train", transform=train_transform)
+        test_dataset = datasets.ImageFolder(root=f"{data_dir}/test", transform=test_transform)
+    return train_dataset, test_dataset
+
+def build_data_loaders(train_dataset, test_dataset, batch_size=32, world_size=1, rank=0, loader_options=None):
+    kwargs = loader_kwargs(**(loader_options or {}))
+    if world_size > 1:
+        # every rank sees a distinct shard of the (identically sorted) image folders
+        train_sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank, shuffle=True)
+        train_loader = DataLoader(train_dataset, batch_size=batch_size, sampler=train_sampler, **kwargs)
+        # strided test shards cover each image exactly once (DistributedSampler would pad with repeats)
+        test_shard = Subset(test_dataset, range(rank, len(test_dataset), world_size))
+        test_loader = DataLoader(test_shard, batch_size=batch_size, shuffle=False, **kwargs)
+    else:
+        train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, **kwargs)
+        test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False, **kwargs)
+    return train_loader, test_loader
+
+def tune_num_workers(dataset, model, criterion, device, batch_size, loader_options, probe_batches=4, precision="fp32"):
+    """Picks the smallest worker count whose data wait stays under 10% of compute time.
+
+    Each candidate runs a few forward/backward passes on a copy of the model
+    (no optimizer step) while measuring how long next() blocks on the loader.
+    Falls back to the candidate with the lowest data wait.
+    """
+    probe_model = copy.deepcopy(model).train()
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    candidates = [0] + [w for w in (1, 2, 4, 8, 16) if w <= cpus]
+    measurements = []
+    for workers in candidates:
+        kwargs = loader_kwargs(**{**loader_options, "num_workers": workers})
+        iterator = iter(DataLoader(dataset, batch_size=batch_size, shuffle=True, **kwargs))
+        next(iterator, None)  # worker start-up is not steady-state data wait
+        data_wait, compute, batches = 0.0, 0.0, 0
+        for _ in range(probe_batches):
+            start = time.perf_counter()
+            batch = next(iterator, None)
+            if batch is None:
+                break
+            loaded = time.perf_counter()
+            images, labels = batch[0].to(device), batch[1].to(device)
+            probe_model.zero_grad()
+            with inference.autocast(precision, device.type):
+                loss = criterion(probe_model(images), labels)
+            loss.backward()
+            data_wait += loaded - start
+            compute += time.perf_counter() - loaded
+            batches += 1
+        del iterator
+        if not batches:
+            break
+        measurements.append({
+            "num_workers": workers,
+            "data_wait_seconds": data_wait / batches,
+            "compute_seconds": compute / batches
+        })
+        if data_wait <= 0.1 * compute:
+            return workers, measurements
+    if not measurements:
+        return 0, measurements
+    return min(measurements, key=lambda m: m["data_wait_seconds"])["num_workers"], measurements
+
+def get_model(base_model, num_classes, pretrained=True):
+    """pretrained=False starts from random weights, so nothing is downloaded."""
+    weights = "IMAGENET1K_V1" if pretrained else None
     if base_model == "mobilenet":
-        model = models.mobilenet_v2(weights="IMAGENET1K_V1")
+        model = models.mobilenet_v2(weights=weights)
         model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
     elif base_model == "efficientnet":
-        model = models.efficientnet_b0(weights="IMAGENET1K_V1")
+        model = models.efficientnet_b0(weights=weights)
         model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
     elif base_model == "resnet":
-        model = models.resnet18(weights="IMAGENET1K_V1")
+        model = models.resnet18(weights=weights)
         model.fc = nn.Linear(model.fc.in_features, num_classes)
     else:
         raise ValueError("Invalid base model.")
     return model
 
-def train(model, train_loader, criterion, optimizer, device):
+def to_device(images, device, channels_last=False):
+    if channels_last:
+        return images.to(device, memory_format=torch.channels_last)
+    return images.to(device)
+
+def train(model, train_loader, criterion, optimizer, device, timings=None, on_batch=None, precision="fp32",
+          channels_last=False, profiler=None):
+    """timings, if given, accumulates data_wait_seconds (blocked on the loader) and compute_seconds.
+
+    on_batch, if given, is called after every batch with (batches, total_loss, correct, total) so far.
+    With precision "bf16" the forward pass and loss run under autocast; the
+    weights, gradients and optimizer state stay fp32, so no loss scaling is needed.
+    channels_last converts each batch to match a model already in that memory format.
+    profiler, a profiling.Profiler, splits each batch into data_wait, h2d,
+    forward, backward and optimizer_step stages.
+    """
     model.train()
-    total_loss, correct, total = 0.0, 0, 0
+    total_loss, correct, total, batches = 0.0, 0, 0, 0
+    data_wait, compute = 0.0, 0.0
+    batch_start = time.perf_counter()
     for images, labels in train_loader:
-        images, labels = images.to(device), labels.to(device)
-        optimizer.zero_grad()
-        outputs = model(images)
-        loss = criterion(outputs, labels)
-        loss.backward()
-        optimizer.step()
+        loaded = time.perf_counter()
+        data_wait += loaded - batch_start
+        if profiler:
+            profiler.add("data_wait", loaded - batch_start)
+        with profiling.stage(profiler, "h2d"):
+            images, labels = to_device(images, device, channels_last), labels.to(device)
+        with profiling.stage(profiler, "forward"):
+            with inference.autocast(precision, device.type):
+                outputs = model(images)
+                loss = criterion(outputs, labels)
+        with profiling.stage(profiler, "backward"):
+            optimizer.zero_grad()
+            loss.backward()
+        with profiling.stage(profiler, "optimizer_step"):
+            optimizer.step()
         total_loss += loss.item()
         _, predicted = torch.max(outputs.data, 1)
         total += labels.size(0)
         correct += (predicted == labels).sum().item()
-    accuracy = 100 * correct / total
-    avg_loss = total_loss / len(train_loader)
-    return avg_loss, accuracy
+        batches += 1
+        if on_batch:
+            on_batch(batches, total_loss, correct, total)
+        if profiler:
+            profiler.step()
+        batch_start = time.perf_counter()
+        compute += batch_start - loaded
+    if timings is not None:
+        timings["data_wait_seconds"] = timings.get("data_wait_seconds", 0.0) + data_wait
+        timings["compute_seconds"] = timings.get("compute_seconds", 0.0) + compute
+    return reduce_metrics(total_loss, len(train_loader), correct, total)
 
-def evaluate(model, test_loader, criterion, device):
+def evaluate(model, test_loader, criterion, device, precision="fp32", channels_last=False):
     model.eval()
     total_loss, correct, total = 0.0, 0, 0
     with torch.no_grad():
         for images, labels in test_loader:
-            images, labels = images.to(device), labels.to(device)
-            outputs = model(images)
-            loss = criterion(outputs, labels)
+            images, labels = to_device(images, device, channels_last), labels.to(device)
+            with inference.autocast(precision, device.type):
+                outputs = model(images)
+                loss = criterion(outputs, labels)
             total_loss += loss.item()
             _, predicted = torch.max(outputs.data, 1)
             total += labels.size(0)
             correct += (predicted == labels).sum().item()
+    return reduce_metrics(total_loss, len(test_loader), correct, total)
+
+def reduce_metrics(total_loss, batches, correct, total):
+    """Returns (avg_loss, accuracy), summed over all ranks when training is distributed."""
+    if dist.is_initialized():
+        totals = torch.tensor([total_loss, batches, correct, total], dtype=torch.float64)
+        dist.all_reduce(totals)
+        total_loss, batches, correct, total = totals.tolist()
     accuracy = 100 * correct / total
-    avg_loss = total_loss / len(test_loader)
+    avg_loss = total_loss / batches
     return avg_loss, accuracy
 
-def generate_report(report_path, args, epochs, epoch_results, model_path, total_time):
+def generate_report(report_path, args, epochs, epoch_results, model_path, total_time, extra=None):
     report = {
         "timestamp": datetime.datetime.now().isoformat(),
         "arguments": vars(args),
@@ -99,9 +238,100 @@ def generate_report(report_path, args, epochs, epoch_results, model_path, total_
         "model_save_path": model_path,
         "total_training_time": round(total_time, 4)
     }
+    report.update(round_floats(extra or {}, 4))
     with open(report_path, 'w') as f:
         json.dump(report, f, indent=4)
 
+def export_torchscript_artifact(model, base_model, num_classes, model_path):
+    """Exports the TorchScript artifact next to the .pth and compares its load time and latency with eager mode."""
+    path = inference.torchscript_path_for(model_path)
+    start = time.perf_counter()
+    inference.export_torchscript(model.cpu(), path)
+    export_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    eager = inference.get_model(base_model, num_classes, model_path)
+    eager_startup = time.perf_counter() - start
+    start = time.perf_counter()
+    scripted = inference.load_torchscript(path)
+    torchscript_startup = time.perf_counter() - start
+    eager_latency = inference.measure_latency(eager)
+    torchscript_latency = inference.measure_latency(scripted)
+    return {
+        "path": path,
+        "export_seconds": export_seconds,
+        "eager": {"startup_seconds": eager_startup, "latency_ms": eager_latency * 1000},
+        "torchscript": {"startup_seconds": torchscript_startup, "latency_ms": torchscript_latency * 1000},
+        "speedup": eager_latency / torchscript_latency
+    }
+
+def quantized_variant(model_path):
+    """Name and artifact path of the int8 variant: models/<name>/<name>.pth -> models/<name>-int8/<name>-int8.torchscript.pt."""
+    model_name = os.path.splitext(os.path.basename(model_path))[0]
+    variant = f"{model_name}-int8"
+    models_dir = os.path.dirname(os.path.dirname(model_path))
+    return variant, os.path.join(models_dir, variant, f"{variant}.torchscript.pt")
+
+def quantize_trained_model(model, method, train_dataset, test_dataset, batch_size, loader_options, model_path,
+                           calibration_batches, criterion):
+    """Saves an int8 variant of the model as a model of its own, and compares it with the fp32 model.
+
+    Both models are evaluated on the full test split; static calibration runs
+    over training images with the test transforms (no augmentation).
+    """
+    calibration_dataset = copy.copy(train_dataset)
+    calibration_dataset.transform = test_dataset.transform
+    calibration_loader, test_loader = build_data_loaders(calibration_dataset, test_dataset, batch_size,
+                                                         loader_options=loader_options)
+    model = model.cpu().eval()
+    start = time.perf_counter()
+    quantized = quantization.quantize(model, method, calibration_loader, calibration_batches)
+    quantize_seconds = time.perf_counter() - start
+    variant, path = quantized_variant(model_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    inference.export_torchscript(quantized, path)
+    served = inference.load_torchscript(path)
+    cpu = torch.device("cpu")
+    _, fp32_accuracy = evaluate(model, test_loader, criterion, cpu)
+    _, int8_accuracy = evaluate(served, test_loader, criterion, cpu)
+    fp32_latency = inference.measure_latency(model)
+    int8_latency = inference.measure_latency(served)
+    fp32_size, int8_size = os.path.getsize(model_path), os.path.getsize(path)
+    return {
+        "method": method,
+        "backend": quantization.quantization_backend() if method == "static" else None,
+        "calibration_batches": calibration_batches if method == "static" else 0,
+        "quantize_seconds": quantize_seconds,
+        "model_name": variant,
+        "path": path,
+        "fp32": {"test_accuracy": fp32_accuracy, "latency_ms": fp32_latency * 1000, "size_bytes": fp32_size},
+        "int8": {"test_accuracy": int8_accuracy, "latency_ms": int8_latency * 1000, "size_bytes": int8_size},
+        "accuracy_delta": int8_accuracy - fp32_accuracy,
+        "speedup": fp32_latency / int8_latency,
+        "size_ratio": int8_size / fp32_size
+    }
+
+def write_variant_report(args, quantization_result, model_path):
+    """The variant's own report, in the shape the node client reads to serve a model."""
+    path = quantization_result["path"]
+    report = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "arguments": vars(args),
+        "model_save_path": path,
+        "torchscript": {"path": path},
+        "source_model_path": model_path,
+        "quantization": round_floats(quantization_result, 4)
+    }
+    with open(os.path.join(os.path.dirname(path), f"{quantization_result['model_name']}.json"), "w") as f:
+        json.dump(report, f, indent=4)
+
+def num_workers_arg(value):
+    return value if value == "auto" else int(value)
+
+def emit_event(events, event, **fields):
+    """Writes one JSON line progress event to the --events-fd stream, if there is one."""
+    if events:
+        events.write(json.dumps(round_floats({"event": event, **fields}, 4)) + "\n")
+
 def print_and_log(output_file, message):
     print(message)
     if output_file:
@@ -109,19 +339,79 @@ def print_and_log(output_file, message):
         with open(output_file, "a", buffering=1) as f:
             f.write(message + "\n")
 
-def main(data_dir, base_model, epochs, batch_size, learning_rate, model_save_path, report_path=None, output_file=None):
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    train_loader, test_loader, num_classes = get_data_loaders(data_dir, batch_size)
-    model = get_model(base_model, num_classes).to(device)
+def main(data_dir, base_model, epochs, batch_size, learning_rate, model_save_path, report_path=None, output_file=None,
+         world_size=1, rank=0, master_addr="127.0.0.1", master_port=29500, dataset_cache=None,
+         num_workers=0, prefetch_factor=None, persistent_workers=False, pin_memory=False,
+         events_fd=None, event_interval=10, torchscript=False, quantize=None, calibration_batches=10,
+         precision="fp32", channels_last=False, compile_model=False, compile_cache_dir=None,
+         num_threads=None, cpus=None, profile=False, profile_trace=None, profile_steps=5):
+    if num_threads or cpus:
+        apply_cpu_limits(cpus, num_threads, interop_threads=1)
+    events = os.fdopen(events_fd, "w", buffering=1) if events_fd is not None else None
+    distributed = world_size > 1
+    if distributed:
+        # CPU data parallel: gradients are all-reduced over gloo after every backward pass
+        dist.init_process_group("gloo", init_method=f"tcp://{master_addr}:{master_port}", world_size=world_size, rank=rank)
+        device = torch.device("cpu")
+    else:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    requested_precision = precision
+    precision = inference.resolve_precision(precision, device_type=device.type)
+    if precision != requested_precision:
+        print_and_log(output_file, f"{requested_precision} is not supported natively on this {device.type}; training in {precision}")
+    train_dataset, test_dataset = get_datasets(data_dir, dataset_cache)
+    model = get_model(base_model, len(train_dataset.classes)).to(device)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
     criterion = nn.CrossEntropyLoss()
+    loader_options = {
+        "num_workers": num_workers,
+        "prefetch_factor": prefetch_factor,
+        "persistent_workers": persistent_workers,
+        "pin_memory": pin_memory
+    }
+    auto_tune = None
+    if num_workers == "auto":
+        loader_options["num_workers"], auto_tune = tune_num_workers(
+            train_dataset, model, criterion, device, batch_size, loader_options, precision=precision)
+        print_and_log(output_file, f"Auto-tuned DataLoader workers: {loader_options['num_workers']}")
+    train_loader, test_loader = build_data_loaders(train_dataset, test_dataset, batch_size, world_size, rank, loader_options)
+    if distributed:
+        model = DistributedDataParallel(model)  # broadcasts rank 0's initial weights to every rank
     optimizer = optim.Adam(model.parameters(), lr=learning_rate)
+    # the compiled module shares its parameters with model, which is what gets saved
+    run_model = model
+    if compile_model:
+        if compile_cache_dir:
+            inference.enable_compile_cache(compile_cache_dir)
+        run_model = torch.compile(model)
+    # --profile-trace implies --profile: the stages are what mark up the trace
+    profiler = profiling.Profiler(device.type, profile_trace, profile_steps) if profile or profile_trace else None
+    if profiler:
+        profiler.start()
     epoch_results = []
     total_start_time = time.time()
+    batches_per_epoch = len(train_loader)
+    emit_event(events, "start", epochs=epochs, batches_per_epoch=batches_per_epoch, world_size=world_size)
 
     for epoch in range(epochs):
+        if distributed:
+            train_loader.sampler.set_epoch(epoch)
         epoch_start_time = time.time()
-        train_loss, train_accuracy = train(model, train_loader, criterion, optimizer, device)
-        test_loss, test_accuracy = evaluate(model, test_loader, criterion, device)
+        timings = {}
+        stages_before = dict(profiler.seconds) if profiler else None
+
+        def on_batch(batches, total_loss, correct, total, epoch=epoch, started=time.perf_counter()):
+            if batches % event_interval == 0 or batches == batches_per_epoch:
+                # this rank's running metrics; throughput is scaled up to all ranks
+                emit_event(events, "batch", epoch=epoch + 1, batch=batches, batches=batches_per_epoch,
+                           loss=total_loss / batches, accuracy=100 * correct / total,
+                           images_per_second=total * world_size / (time.perf_counter() - started))
+
+        train_loss, train_accuracy = train(run_model, train_loader, criterion, optimizer, device, timings,
+                                           on_batch if events else None, precision, channels_last, profiler)
+        with profiling.stage(profiler, "eval"):
+            test_loss, test_accuracy = evaluate(run_model, test_loader, criterion, device, precision, channels_last)
         epoch_time = time.time() - epoch_start_time
         log_message = (f"Epoch [{epoch + 1}/{epochs}], "
                        f"Train Loss: {train_loss:.4f}, Train Accuracy: {train_accuracy:.2f}%, "
@@ -134,17 +424,65 @@ def main(data_dir, base_model, epochs, batch_size, learning_rate, model_save_pat
             "train_accuracy": train_accuracy,
             "test_loss": test_loss,
             "test_accuracy": test_accuracy,
-            "epoch_time_seconds": epoch_time
+            "epoch_time_seconds": epoch_time,
+            **timings,
+            **({"stages": profiler.since(stages_before)} if profiler else {})
         }, 4))
+        train_seconds = timings["data_wait_seconds"] + timings["compute_seconds"]
+        emit_event(events, "epoch", **epoch_results[-1],
+                   images_per_second=len(train_loader.sampler) * world_size / train_seconds if train_seconds else None)
 
     total_time = time.time() - total_start_time
+    if profiler:
+        profiler.stop()  # the trace covers training; later stages are only timed
+    if distributed:
+        model = model.module
+        dist.destroy_process_group()
+        if rank != 0:
+            print_and_log(output_file, f"Rank {rank} finished; model is saved by rank 0")
+            return
+    if channels_last:
+        model = model.to(memory_format=torch.contiguous_format)  # for export and quantization
     model_path = os.path.abspath(model_save_path)
-    torch.save(model.state_dict(), model_path)
+    with profiling.stage(profiler, "save"):
+        torch.save(model.state_dict(), model_path)
     print_and_log(output_file, f"Model saved as {model_path}")
     print_and_log(output_file, f"Total training time: {total_time:.2f} seconds")
+    torchscript_export = None
+    if torchscript:
+        with profiling.stage(profiler, "torchscript_export"):
+            torchscript_export = export_torchscript_artifact(model, base_model, len(train_dataset.classes), model_path)
+        print_and_log(output_file, f"TorchScript artifact saved as {torchscript_export['path']} "
+                                   f"({torchscript_export['torchscript']['latency_ms']:.2f} ms vs "
+                                   f"{torchscript_export['eager']['latency_ms']:.2f} ms eager per image)")
+
+    quantization_result = None
+    if quantize:
+        with profiling.stage(profiler, "quantize"):
+            quantization_result = quantize_trained_model(model, quantize, train_dataset, test_dataset, batch_size,
+                                                         loader_options, model_path, calibration_batches, criterion)
+        write_variant_report(args, quantization_result, model_path)
+        print_and_log(output_file, f"Int8 model '{quantization_result['model_name']}' saved as {quantization_result['path']}: "
+                                   f"accuracy {quantization_result['accuracy_delta']:+.2f} points, "
+                                   f"{quantization_result['speedup']:.2f}x faster, "
+                                   f"{quantization_result['size_ratio']:.2f}x the size")
+
+    if profiler:
+        print_and_log(output_file, f"Stage times: {profiling.format_summary(profiler.summary())}")
+        if profile_trace:
+            print_and_log(output_file, f"Profiler trace saved to {profile_trace}")
 
     if report_path:
-        generate_report(report_path, args, epochs, epoch_results, model_path, total_time)
+        generate_report(report_path, args, epochs, epoch_results, model_path, total_time, {
+            "distributed": {"backend": "gloo", "world_size": world_size} if distributed else None,
+            "data_loading": {**loader_options, "auto_tune": auto_tune},
+            "precision": {"requested": requested_precision, "used": precision},
+            "cpu": {"threads": torch.get_num_threads(), "cpus": cpus},
+            "execution": {"channels_last": channels_last, "compile": compile_model, "compile_cache_dir": compile_cache_dir},
+            "torchscript": torchscript_export,
+            "quantization": quantization_result,
+            "profile": profiler.summary() if profiler else None
+        })
         print_and_log(output_file, f"Report saved to {report_path}")
 
 if __name__ == "__main__":
@@ -157,5 +495,34 @@ if __name__ == "__main__":
     parser.add_argument("--model-save-path", type=str, required=True)
     parser.add_argument("--report", type=str)
     parser.add_argument("--output-file", type=str)
+    # defaults come from the environment so the script also runs under torchrun
+    parser.add_argument("--world-size", type=int, default=int(os.getenv("WORLD_SIZE", 1)))
+    parser.add_argument("--rank", type=int, default=int(os.getenv("RANK", 0)))
+    parser.add_argument("--master-addr", type=str, default=os.getenv("MASTER_ADDR", "127.0.0.1"))
+    parser.add_argument("--master-port", type=int, default=int(os.getenv("MASTER_PORT", 29500)))
+    parser.add_argument("--dataset-cache", type=str, help="Directory for the pre-decoded, pre-resized image cache (rebuilt when the data changes)")
+    parser.add_argument("--num-workers", type=num_workers_arg, default=0, help="DataLoader worker processes, or 'auto' to measure and pick")
+    parser.add_argument("--prefetch-factor", type=int, help="Batches prefetched per worker")
+    parser.add_argument("--persistent-workers", action="store_true", help="Keep DataLoader workers alive between epochs")
+    parser.add_argument("--pin-memory", action="store_true", help="Use pinned memory for batches")
+    parser.add_argument("--events-fd", type=int, help="Inherited file descriptor to write JSON line progress events to")
+    parser.add_argument("--event-interval", type=int, default=10, help="Emit a batch event every N batches")
+    parser.add_argument("--torchscript", action="store_true", help="Also export a frozen, optimized TorchScript artifact for inference")
+    parser.add_argument("--quantize", choices=quantization.METHODS, help="Also save an int8 variant as model '<name>-int8'")
+    parser.add_argument("--calibration-batches", type=int, default=10, help="Training batches used to calibrate static quantization")
+    parser.add_argument("--precision", choices=inference.PRECISIONS, default="fp32", help="bf16 trains under autocast where the hardware supports it, fp32 otherwise")
+    parser.add_argument("--num-threads", type=int, help="torch intra-op threads (default: torch's choice, one per core)")
+    parser.add_argument("--cpus", type=parse_cpu_list, help="Pin training (and its DataLoader workers) to these cores, e.g. 0-3")
+    parser.add_argument("--channels-last", action="store_true", help="Train with the model and batches in channels_last memory format")
+    parser.add_argument("--compile", action="store_true", help="Compile the model with torch.compile")
+    parser.add_argument("--compile-cache-dir", type=str, help="Directory that keeps compiled kernels across runs")
+    parser.add_argument("--profile", action="store_true", help="Record per-stage wall time (data wait, H2D, forward, backward, optimizer step, eval, save) in the report")
+    parser.add_argument("--profile-trace", type=str, help="Also write a torch.profiler Chrome trace of the first training batches to this path")
+    parser.add_argument("--profile-steps", type=int, default=5, help="Training batches recorded in the --profile-trace trace")
     args = parser.parse_args()
-    main(args.data_dir, args.base_model, args.epochs, args.batch_size, args.learning_rate, args.model_save_path, args.report, args.output_file)
+    main(args.data_dir, args.base_model, args.epochs, args.batch_size, args.learning_rate, args.model_save_path, args.report, args.output_file,
+         args.world_size, args.rank, args.master_addr, args.master_port, args.dataset_cache,
+         args.num_workers, args.prefetch_factor, args.persistent_workers, args.pin_memory,
+         args.events_fd, args.event_interval, args.torchscript, args.quantize, args.calibration_batches,
+         args.precision, args.channels_last, args.compile, args.compile_cache_dir,
+         args.num_threads, args.cpus, args.profile, args.profile_trace, args.profile_steps)
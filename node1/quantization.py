@@ -0,0 +1,36 @@
+# quantization.py
+#
+# Post-training int8 quantization for CPU serving. "dynamic" quantizes only
+# the Linear classifier's weights (activations are quantized on the fly), so
+# it needs no data but leaves the convolutions in fp32. "static" quantizes
+# every layer with FX graph mode after a calibration pass that records
+# activation ranges on training images.
+
+import copy
+import itertools
+
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+METHODS = ["dynamic", "static"]
+
+def quantization_backend():
+    engines = torch.backends.quantized.supported_engines
+    return next((engine for engine in ("x86", "fbgemm", "qnnpack") if engine in engines), engines[0])
+
+def quantize(model, method, calibration_loader=None, calibration_batches=10):
+    """Returns an int8 copy of the (CPU, eval mode) model; static needs calibration_loader."""
+    model = model.cpu().eval()
+    if method == "dynamic":
+        return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    if method != "static":
+        raise ValueError(f"Invalid quantization method. Choose from: {', '.join(METHODS)}.")
+    backend = quantization_backend()
+    torch.backends.quantized.engine = backend
+    prepared = prepare_fx(copy.deepcopy(model), get_default_qconfig_mapping(backend), (torch.randn(1, 3, 224, 224),))
+    with torch.no_grad():
+        for images, _ in itertools.islice(calibration_loader, calibration_batches):
+            prepared(images)
+    return convert_fx(prepared)
@@ -0,0 +1,132 @@
+# batcher.py
+
+import threading
+import time
+
+import torch
+
+import inference
+
+class BatchRequest:
+    def __init__(self, model, class_names, image, callback, precision="fp32"):
+        self.model = model
+        self.class_names = class_names
+        self.precision = precision
+        self.image = image  # (1, 3, 224, 224) tensor from inference.preprocess_image
+        self.callback = callback  # callback(prediction, error)
+        self.arrival = time.perf_counter()
+
+class ModelBatcher:
+    """Queue and worker thread for one model.
+
+    The worker waits for the first request, keeps collecting until the batch
+    window has passed since that request arrived or max_batch_size requests
+    are queued, then runs a single forward pass and hands each request its
+    own row of the result.
+    """
+
+    def __init__(self, window_seconds, max_batch_size, idle_seconds, on_idle, on_batch=None):
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.idle_seconds = idle_seconds
+        self.on_idle = on_idle
+        self.on_batch = on_batch
+        self.queue = []
+        self.condition = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, request):
+        with self.condition:
+            if self.closed:
+                return False
+            self.queue.append(request)
+            self.condition.notify()
+            return True
+
+    def depth(self):
+        with self.condition:
+            return len(self.queue)
+
+    def next_batch(self):
+        with self.condition:
+            while not self.queue:
+                if not self.condition.wait(self.idle_seconds) and not self.queue:
+                    self.closed = True
+                    return None
+            deadline = self.queue[0].arrival + self.window_seconds
+            while len(self.queue) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            # Only requests for the same loaded model and precision can share a forward pass
+            first = self.queue[0]
+            batch = [r for r in self.queue[:self.max_batch_size]
+                     if r.model is first.model and r.precision == first.precision]
+            taken = set(map(id, batch))
+            self.queue = [r for r in self.queue if id(r) not in taken]
+            return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                self.on_idle(self)
+                return
+            if self.on_batch:
+                self.on_batch(len(batch))
+            try:
+                images = torch.cat([r.image for r in batch])
+                predictions = inference.predict_batch(images, batch[0].model, batch[0].class_names, batch[0].precision)
+            except Exception as e:
+                for request in batch:
+                    self.deliver(request, None, e)
+                continue
+            for request, prediction in zip(batch, predictions):
+                self.deliver(request, prediction, None)
+
+    def deliver(self, request, prediction, error):
+        # a failing callback must not end this thread: the batcher stays registered and later requests would hang
+        try:
+            request.callback(prediction, error)
+        except Exception as e:
+            print(f"Error in inference callback: {e}")
+
+class MicroBatcher:
+    """Merges concurrent inference requests into batched forward passes, one queue per model name.
+
+    on_batch, if given, is called with the size of every batch before its forward pass.
+    """
+
+    def __init__(self, window_ms=5, max_batch_size=16, idle_seconds=60, on_batch=None):
+        self.window_seconds = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.idle_seconds = idle_seconds
+        self.on_batch = on_batch
+        self.batchers = {}
+        self.lock = threading.Lock()
+
+    def submit(self, model_name, model, class_names, image, callback, precision="fp32"):
+        request = BatchRequest(model, class_names, image, callback, precision)
+        while True:
+            with self.lock:
+                batcher = self.batchers.get(model_name)
+                if batcher is None:
+                    batcher = ModelBatcher(self.window_seconds, self.max_batch_size, self.idle_seconds,
+                                           lambda b, name=model_name: self._remove(name, b), self.on_batch)
+                    self.batchers[model_name] = batcher
+            if batcher.submit(request):
+                return
+            self._remove(model_name, batcher)  # batcher went idle between lookup and submit
+
+    def _remove(self, model_name, batcher):
+        with self.lock:
+            if self.batchers.get(model_name) is batcher:
+                del self.batchers[model_name]
+
+    def queue_depth(self):
+        with self.lock:
+            batchers = list(self.batchers.values())
+        return sum(b.depth() for b in batchers)
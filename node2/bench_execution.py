@@ -0,0 +1,106 @@
+# bench_execution.py
+#
+# Compares the execution modes of every base model: plain eager NCHW,
+# channels_last, and channels_last compiled with torch.compile. For each it
+# reports the warm-up time (the compilation, for compiled models), inference
+# images/s and training images/s (forward, backward and optimizer step) on
+# random inputs with untrained weights. Compiled kernels are cached in
+# --compile-cache-dir, so a second run shows the warm-cache start-up.
+#
+#   python3 bench_execution.py --batch-size 16 --steps 10
+
+import argparse
+import json
+import time
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+import inference
+import train
+from bench_batching import CLASS_NAMES
+
+BASE_MODELS = ["mobilenet", "efficientnet", "resnet"]
+MODES = {
+    "eager": {"channels_last": False, "compile_model": False},
+    "channels_last": {"channels_last": True, "compile_model": False},
+    "channels_last+compile": {"channels_last": True, "compile_model": True},
+}
+
+def throughput(step, batch_size, steps):
+    start = time.perf_counter()
+    for _ in range(steps):
+        step()
+    return batch_size * steps / (time.perf_counter() - start)
+
+def bench_inference(base_model, mode, batch_size, steps, compile_cache_dir):
+    start = time.perf_counter()
+    model = inference.prepare_model(train.get_model(base_model, len(CLASS_NAMES), pretrained=False).eval(),
+                                    compile_cache_dir=compile_cache_dir,
+                                    warmup_batch_sizes=(batch_size,), **MODES[mode])
+    warmup_seconds = time.perf_counter() - start
+    images = torch.randn(batch_size, 3, 224, 224)
+    with torch.no_grad():
+        model(images)
+        images_per_second = throughput(lambda: model(images), batch_size, steps)
+    return warmup_seconds, images_per_second
+
+def bench_training(base_model, mode, batch_size, steps, compile_cache_dir):
+    channels_last, compile_model = MODES[mode]["channels_last"], MODES[mode]["compile_model"]
+    model = train.get_model(base_model, len(CLASS_NAMES), pretrained=False).train()
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    run_model = model
+    if compile_model:
+        inference.enable_compile_cache(compile_cache_dir)
+        run_model = torch.compile(model)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=0.001)
+    images = torch.randn(batch_size, 3, 224, 224)
+    if channels_last:
+        images = images.contiguous(memory_format=torch.channels_last)
+    labels = torch.randint(0, 3, (batch_size,))
+
+    def step():
+        optimizer.zero_grad()
+        criterion(run_model(images), labels).backward()
+        optimizer.step()
+
+    start = time.perf_counter()
+    step()
+    warmup_seconds = time.perf_counter() - start
+    return warmup_seconds, throughput(step, batch_size, steps)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark channels_last and torch.compile execution modes.")
+    parser.add_argument("--base-models", default=",".join(BASE_MODELS), help="Comma separated base models")
+    parser.add_argument("--modes", default=",".join(MODES), help="Comma separated execution modes")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--steps", type=int, default=10, help="Timed batches per measurement")
+    parser.add_argument("--compile-cache-dir", default="cache/compile")
+    parser.add_argument("--output", help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for base_model in args.base_models.split(","):
+        for mode in args.modes.split(","):
+            inference_warmup, inference_ips = bench_inference(base_model, mode, args.batch_size, args.steps, args.compile_cache_dir)
+            training_warmup, training_ips = bench_training(base_model, mode, args.batch_size, args.steps, args.compile_cache_dir)
+            results.append({
+                "base_model": base_model,
+                "mode": mode,
+                "inference_warmup_seconds": round(inference_warmup, 2),
+                "inference_images_per_second": round(inference_ips, 2),
+                "training_warmup_seconds": round(training_warmup, 2),
+                "training_images_per_second": round(training_ips, 2)
+            })
+
+    print(f"batch {args.batch_size}, {args.steps} steps, {torch.get_num_threads()} threads")
+    print(f"{'model':<14}{'mode':<24}{'infer warm-up s':>16}{'infer img/s':>13}{'train warm-up s':>16}{'train img/s':>13}")
+    for r in results:
+        print(f"{r['base_model']:<14}{r['mode']:<24}{r['inference_warmup_seconds']:>16}{r['inference_images_per_second']:>13}"
+              f"{r['training_warmup_seconds']:>16}{r['training_images_per_second']:>13}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
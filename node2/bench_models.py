@@ -0,0 +1,226 @@
+# bench_models.py
+#
+# Repeatable micro-benchmarks of the training and inference code paths, on
+# synthetic data so they run offline. It measures images/s for:
+#
+#   data_loading      the train.py input pipeline alone (JPEG decode, resize, augmentation)
+#   data_loading_cached  the same with the pre-decoded dataset cache
+#   forward           inference.predict_batch's forward pass (eval, no_grad)
+#   forward_backward  training forward, loss and backward, no optimizer step
+#   train_epoch       a full train.train() epoch over the synthetic image folder
+#
+# for every base model, batch size and thread count. The synthetic dataset is
+# a temporary image folder of random JPEGs and the models have random
+# weights (train.get_model(pretrained=False)).
+#
+# Results go to --output as JSON. With --baseline, each result is compared
+# with the matching one in an earlier output and flagged as a regression when
+# it is more than --tolerance slower; the exit status is then 1.
+#
+#   python3 bench_models.py --batch-sizes 8,32 --threads 1,4 --output bench.json
+#   python3 bench_models.py --batch-sizes 8,32 --threads 1,4 --baseline bench.json
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from PIL import Image
+
+import inference
+import train
+
+BASE_MODELS = ["mobilenet", "efficientnet", "resnet"]
+BENCHMARKS = ["data_loading", "data_loading_cached", "forward", "forward_backward", "train_epoch"]
+CLASS_NAMES = ["chicken", "cow", "dog"]
+
+def write_synthetic_images(data_dir, images_per_class, size=(400, 300), seed=0):
+    """Writes train/ and test/ image folders of random JPEGs, smooth enough to compress like photos."""
+    rng = np.random.default_rng(seed)
+    for split in ("train", "test"):
+        for class_name in CLASS_NAMES:
+            class_dir = os.path.join(data_dir, split, class_name)
+            os.makedirs(class_dir, exist_ok=True)
+            for i in range(images_per_class):
+                pixels = rng.integers(0, 256, (12, 16, 3), dtype=np.uint8)
+                image = Image.fromarray(pixels).resize(size, Image.BILINEAR)
+                image.save(os.path.join(class_dir, f"{i}.jpg"), quality=90)
+
+def fresh_model(base_model, seed):
+    """The same random weights every call, so train_epoch's optimizer steps never reach another benchmark's model."""
+    torch.manual_seed(seed)
+    return train.get_model(base_model, len(CLASS_NAMES), pretrained=False)
+
+def best_rate(run, images, repeats):
+    """Highest images/s over repeats runs of run(), after one untimed warm-up run."""
+    run()
+    best = 0.0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        best = max(best, images / (time.perf_counter() - start))
+    return best
+
+def bench_data_loading(dataset, batch_size, steps, repeats, loader_options):
+    loader, _ = train.build_data_loaders(dataset, dataset, batch_size, loader_options=loader_options)
+
+    def run():
+        iterator = iter(loader)
+        for _ in range(steps):
+            next(iterator)
+
+    return best_rate(run, batch_size * steps, repeats)
+
+def bench_forward(model, batch_size, steps, repeats):
+    model.eval()
+    images = torch.randn(batch_size, 3, 224, 224)
+
+    def run():
+        for _ in range(steps):
+            inference.predict_batch(images, model, CLASS_NAMES)
+
+    return best_rate(run, batch_size * steps, repeats)
+
+def bench_forward_backward(model, batch_size, steps, repeats):
+    model.train()
+    criterion = nn.CrossEntropyLoss()
+    images = torch.randn(batch_size, 3, 224, 224)
+    labels = torch.randint(0, len(CLASS_NAMES), (batch_size,))
+
+    def run():
+        for _ in range(steps):
+            model.zero_grad()
+            criterion(model(images), labels).backward()
+
+    return best_rate(run, batch_size * steps, repeats)
+
+def bench_train_epoch(model, dataset, batch_size, repeats, loader_options):
+    loader, _ = train.build_data_loaders(dataset, dataset, batch_size, loader_options=loader_options)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=0.001)
+    device = torch.device("cpu")
+    return best_rate(lambda: train.train(model, loader, criterion, optimizer, device), len(dataset), repeats)
+
+def result_key(result):
+    return (result["benchmark"], result["base_model"], result["batch_size"], result["threads"])
+
+def compare(results, baseline, tolerance):
+    """Adds baseline_images_per_second, change and status (ok, regression, improvement or new) to every result."""
+    previous = {result_key(r): r for r in baseline["results"]}
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None:
+            result["status"] = "new"
+            continue
+        change = result["images_per_second"] / old["images_per_second"] - 1
+        result["baseline_images_per_second"] = old["images_per_second"]
+        result["change"] = round(change, 4)
+        if change < -tolerance:
+            result["status"] = "regression"
+        elif change > tolerance:
+            result["status"] = "improvement"
+        else:
+            result["status"] = "ok"
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "machine": platform.machine(),
+        "cpus": len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count(),
+        "bf16_supported": inference.bf16_supported()
+    }
+
+def run_benchmarks(args, data_dir):
+    benchmarks = args.benchmarks.split(",")
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+    thread_counts = [int(t) for t in args.threads.split(",")]
+    loader_options = {"num_workers": args.num_workers}
+    train_dataset, _ = train.get_datasets(data_dir)
+    cached_dataset = None
+    if "data_loading_cached" in benchmarks:
+        cached_dataset, _ = train.get_datasets(data_dir, os.path.join(data_dir, "cache"))
+    results = []
+
+    def record(benchmark, base_model, batch_size, threads, images_per_second):
+        result = {"benchmark": benchmark, "base_model": base_model, "batch_size": batch_size,
+                  "threads": threads, "images_per_second": round(images_per_second, 2)}
+        results.append(result)
+        print(f"{benchmark:<22}{base_model or '-':<14}{batch_size:>7}{threads:>9}{result['images_per_second']:>12}", flush=True)
+
+    print(f"{'benchmark':<22}{'model':<14}{'batch':>7}{'threads':>9}{'img/s':>12}")
+    for threads in thread_counts:
+        torch.set_num_threads(threads)
+        for batch_size in batch_sizes:
+            steps = max(1, min(args.steps, len(train_dataset) // batch_size))
+            if "data_loading" in benchmarks:
+                record("data_loading", None, batch_size, threads,
+                       bench_data_loading(train_dataset, batch_size, steps, args.repeats, loader_options))
+            if cached_dataset is not None:
+                record("data_loading_cached", None, batch_size, threads,
+                       bench_data_loading(cached_dataset, batch_size, steps, args.repeats, loader_options))
+            for base_model in args.base_models.split(","):
+                if "forward" in benchmarks:
+                    record("forward", base_model, batch_size, threads,
+                           bench_forward(fresh_model(base_model, args.seed), batch_size, args.steps, args.repeats))
+                if "forward_backward" in benchmarks:
+                    record("forward_backward", base_model, batch_size, threads,
+                           bench_forward_backward(fresh_model(base_model, args.seed), batch_size, args.steps, args.repeats))
+                if "train_epoch" in benchmarks:
+                    record("train_epoch", base_model, batch_size, threads,
+                           bench_train_epoch(fresh_model(base_model, args.seed), train_dataset, batch_size, args.repeats, loader_options))
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark the training and inference pipelines on synthetic data.")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS), help="Comma separated benchmarks")
+    parser.add_argument("--base-models", default=",".join(BASE_MODELS), help="Comma separated base models")
+    parser.add_argument("--batch-sizes", default="8,32", help="Comma separated batch sizes")
+    parser.add_argument("--threads", default=str(torch.get_num_threads()), help="Comma separated torch thread counts")
+    parser.add_argument("--steps", type=int, default=5, help="Batches per timed run")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per measurement (the fastest counts)")
+    parser.add_argument("--images-per-class", type=int, default=32, help="Synthetic training images per class (also the train_epoch size)")
+    parser.add_argument("--num-workers", type=int, default=0, help="DataLoader worker processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Path to write results as JSON")
+    parser.add_argument("--baseline", help="Earlier --output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    unknown = set(args.benchmarks.split(",")) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}. Choose from: {', '.join(BENCHMARKS)}.")
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_synthetic_images(data_dir, args.images_per_class, seed=args.seed)
+        results = run_benchmarks(args, data_dir)
+
+    report = {"environment": environment(), "settings": vars(args), "results": results}
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("environment") != report["environment"]:
+            print("Warning: the baseline was recorded in a different environment:", baseline.get("environment"))
+        compare(results, baseline, args.tolerance)
+        regressions = [r for r in results if r["status"] == "regression"]
+        print(f"\nCompared with {args.baseline} (tolerance {args.tolerance:.0%})")
+        print(f"{'benchmark':<22}{'model':<14}{'batch':>7}{'threads':>9}{'img/s':>12}{'baseline':>12}{'change':>9}  status")
+        for r in results:
+            baseline_rate = r.get("baseline_images_per_second", "-")
+            change = f"{r['change']:+.1%}" if "change" in r else "-"
+            flag = r["status"].upper() if r["status"] == "regression" else r["status"]
+            print(f"{r['benchmark']:<22}{r['base_model'] or '-':<14}{r['batch_size']:>7}{r['threads']:>9}"
+                  f"{r['images_per_second']:>12}{baseline_rate:>12}{change:>9}  {flag}")
+        report["baseline"] = {"path": args.baseline, "tolerance": args.tolerance, "regressions": len(regressions)}
+        print(f"\n{len(regressions)} regression(s)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,70 @@
+# bench_precision.py
+#
+# Trains every base model for --epochs at fp32 and at bf16 (CPU autocast)
+# from the same seed and pretrained weights, and compares epoch time,
+# training throughput and test accuracy. Needs the dataset in --data-dir;
+# --dataset-cache keeps image decoding out of the timings.
+#
+#   python3 bench_precision.py --data-dir ./images --dataset-cache cache/dataset --epochs 1
+
+import argparse
+import json
+import time
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+import inference
+import train
+
+BASE_MODELS = ["mobilenet", "efficientnet", "resnet"]
+
+def run(base_model, precision, train_dataset, test_dataset, batch_size, epochs, learning_rate, seed):
+    torch.manual_seed(seed)
+    train_loader, test_loader = train.build_data_loaders(train_dataset, test_dataset, batch_size)
+    device = torch.device("cpu")
+    model = train.get_model(base_model, len(train_dataset.classes))
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=learning_rate)
+    epoch_times = []
+    for _ in range(epochs):
+        start = time.perf_counter()
+        train.train(model, train_loader, criterion, optimizer, device, precision=precision)
+        epoch_times.append(time.perf_counter() - start)
+    _, test_accuracy = train.evaluate(model, test_loader, criterion, device, precision)
+    return {
+        "base_model": base_model,
+        "precision": precision,
+        "epoch_seconds": round(sum(epoch_times) / len(epoch_times), 3),
+        "images_per_second": round(len(train_dataset) * epochs / sum(epoch_times), 2),
+        "test_accuracy": round(test_accuracy, 2)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark fp32 against bf16 autocast training.")
+    parser.add_argument("--data-dir", default="./images")
+    parser.add_argument("--dataset-cache", help="Directory for the pre-decoded image cache")
+    parser.add_argument("--base-models", default=",".join(BASE_MODELS), help="Comma separated base models")
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--learning-rate", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    if not inference.bf16_supported():
+        print("Warning: this CPU has no native bf16, so bf16 is emulated and the comparison is not representative")
+    train_dataset, test_dataset = train.get_datasets(args.data_dir, args.dataset_cache)
+    results = [run(base_model, precision, train_dataset, test_dataset, args.batch_size, args.epochs,
+                   args.learning_rate, args.seed)
+               for base_model in args.base_models.split(",") for precision in inference.PRECISIONS]
+
+    print(f"{len(train_dataset)} training images, {args.epochs} epoch(s), batch {args.batch_size}, {torch.get_num_threads()} threads")
+    print(f"{'model':<14}{'precision':>10}{'epoch s':>10}{'img/s':>10}{'test acc %':>12}")
+    for result in results:
+        print(f"{result['base_model']:<14}{result['precision']:>10}{result['epoch_seconds']:>10}"
+              f"{result['images_per_second']:>10}{result['test_accuracy']:>12}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,103 @@
+# bench_torchscript.py
+#
+# Compares eager models with their exported TorchScript artifacts (traced
+# and frozen, then optimize_for_inference at load) for every base model.
+# Startup is measured in a fresh Python process, from interpreter start to a
+# model that has answered its first request, so it includes imports: the
+# artifact needs only torch, while eager mode also builds the torchvision
+# model. Weights are untrained, so no dataset is needed.
+#
+#   python3 bench_torchscript.py --runs 50 --batch-sizes 1,8
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import torch
+
+import inference
+import train
+from bench_batching import CLASS_NAMES
+
+BASE_MODELS = ["mobilenet", "efficientnet", "resnet"]
+
+EAGER_STARTUP = """
+import time; start = time.perf_counter()
+import torch, inference
+model = inference.get_model({base_model!r}, {num_classes}, {path!r})
+with torch.no_grad():
+    model(torch.zeros(1, 3, 224, 224))
+print(time.perf_counter() - start)
+"""
+
+TORCHSCRIPT_STARTUP = """
+import time; start = time.perf_counter()
+import torch
+model = torch.jit.optimize_for_inference(torch.jit.load({path!r}))
+with torch.no_grad():
+    for _ in range(3):
+        model(torch.zeros(1, 3, 224, 224))
+print(time.perf_counter() - start)
+"""
+
+def startup_seconds(script, repeats):
+    here = os.path.dirname(os.path.abspath(__file__))
+    timings = [float(subprocess.run([sys.executable, "-c", script], cwd=here, check=True,
+                                    capture_output=True, text=True).stdout.strip().splitlines()[-1])
+               for _ in range(repeats)]
+    return min(timings)
+
+def bench(base_model, directory, batch_sizes, runs, startup_repeats):
+    model_path = os.path.join(directory, f"{base_model}.pth")
+    torch.save(train.get_model(base_model, len(CLASS_NAMES), pretrained=False).state_dict(), model_path)
+    eager = inference.get_model(base_model, len(CLASS_NAMES), model_path)
+    torchscript_path = inference.torchscript_path_for(model_path)
+    inference.export_torchscript(eager, torchscript_path)
+    scripted = inference.load_torchscript(torchscript_path)
+    result = {
+        "base_model": base_model,
+        "eager_startup_seconds": round(startup_seconds(EAGER_STARTUP.format(
+            base_model=base_model, num_classes=len(CLASS_NAMES), path=model_path), startup_repeats), 3),
+        "torchscript_startup_seconds": round(startup_seconds(TORCHSCRIPT_STARTUP.format(
+            path=torchscript_path), startup_repeats), 3),
+        "latency": []
+    }
+    for batch_size in batch_sizes:
+        eager_ms = inference.measure_latency(eager, batch_size, runs) * 1000
+        torchscript_ms = inference.measure_latency(scripted, batch_size, runs) * 1000
+        result["latency"].append({
+            "batch_size": batch_size,
+            "eager_ms": round(eager_ms, 2),
+            "torchscript_ms": round(torchscript_ms, 2),
+            "speedup": round(eager_ms / torchscript_ms, 2)
+        })
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark TorchScript artifacts against eager models.")
+    parser.add_argument("--base-models", default=",".join(BASE_MODELS), help="Comma separated base models")
+    parser.add_argument("--batch-sizes", default="1,8", help="Comma separated batch sizes for the latency comparison")
+    parser.add_argument("--runs", type=int, default=30, help="Timed forward passes per measurement")
+    parser.add_argument("--startup-repeats", type=int, default=3, help="Fresh processes per startup measurement (the fastest counts)")
+    parser.add_argument("--output", help="Optional path to write results as JSON")
+    args = parser.parse_args()
+
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",")]
+    with tempfile.TemporaryDirectory() as directory:
+        results = [bench(base_model, directory, batch_sizes, args.runs, args.startup_repeats)
+                   for base_model in args.base_models.split(",")]
+
+    print(f"{torch.get_num_threads()} threads, median of {args.runs} runs")
+    print(f"{'model':<14}{'startup eager s':>17}{'startup ts s':>14}{'batch':>7}{'eager ms':>10}{'ts ms':>10}{'speedup':>9}")
+    for result in results:
+        for i, latency in enumerate(result["latency"]):
+            startup = (f"{result['eager_startup_seconds']:>17}{result['torchscript_startup_seconds']:>14}"
+                       if i == 0 else " " * 31)
+            print(f"{result['base_model'] if i == 0 else '':<14}{startup}{latency['batch_size']:>7}"
+                  f"{latency['eager_ms']:>10}{latency['torchscript_ms']:>10}{latency['speedup']:>9}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
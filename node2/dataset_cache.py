@@ -0,0 +1,98 @@
+# dataset_cache.py
+#
+# One-time decode + resize of an ImageFolder split into a memory-mapped uint8
+# array, so training epochs skip JPEG decoding and resizing entirely.
+#
+#   <cache_dir>/<split>/images.npy     (N, 224, 224, 3) uint8
+#   <cache_dir>/<split>/labels.npy     (N,) int64
+#   <cache_dir>/<split>/manifest.json  source fingerprint, classes, count
+
+import hashlib
+import json
+import os
+
+import numpy as np
+from PIL import Image
+from torch.utils.data import Dataset
+from torchvision import datasets
+
+CACHE_VERSION = 1
+IMAGE_SIZE = 224
+
+def source_fingerprint(split_dir):
+    """Hashes every file's path, size and mtime, so adding, removing or editing an image changes it."""
+    digest = hashlib.sha256(f"v{CACHE_VERSION}:{IMAGE_SIZE}".encode())
+    for root, dirs, files in os.walk(split_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            digest.update(f"{os.path.relpath(path, split_dir)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+def read_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, "manifest.json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def build_cache(split_dir, cache_dir, fingerprint):
+    folder = datasets.ImageFolder(root=split_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    suffix = f".tmp-{os.getpid()}"
+    images_path = os.path.join(cache_dir, "images.npy")
+    labels_path = os.path.join(cache_dir, "labels.npy")
+    images = np.lib.format.open_memmap(images_path + suffix, mode="w+", dtype=np.uint8,
+                                       shape=(len(folder.samples), IMAGE_SIZE, IMAGE_SIZE, 3))
+    for index, (path, _) in enumerate(folder.samples):
+        with Image.open(path) as image:
+            # same resize torchvision's Resize((224, 224)) applies to PIL images
+            images[index] = np.asarray(image.convert("RGB").resize((IMAGE_SIZE, IMAGE_SIZE), Image.BILINEAR))
+    images.flush()
+    del images
+    with open(labels_path + suffix, "wb") as f:
+        np.save(f, np.array(folder.targets, dtype=np.int64))
+    # the manifest is replaced last, so a reader never pairs it with half-written arrays
+    os.replace(images_path + suffix, images_path)
+    os.replace(labels_path + suffix, labels_path)
+    manifest = {
+        "version": CACHE_VERSION,
+        "fingerprint": fingerprint,
+        "source": os.path.abspath(split_dir),
+        "classes": folder.classes,
+        "count": len(folder.samples),
+        "image_size": IMAGE_SIZE
+    }
+    with open(os.path.join(cache_dir, "manifest.json" + suffix), "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(os.path.join(cache_dir, "manifest.json" + suffix), os.path.join(cache_dir, "manifest.json"))
+    return manifest
+
+class CachedImageDataset(Dataset):
+    """ImageFolder replacement that reads pre-resized images from the cache.
+
+    Samples are 224x224 PIL images wrapped around rows of the memory map, so
+    transform only needs the random augmentations, ToTensor and Normalize.
+    """
+
+    def __init__(self, split_dir, cache_dir, transform=None):
+        fingerprint = source_fingerprint(split_dir)
+        manifest = read_manifest(cache_dir)
+        self.rebuilt = manifest is None or manifest.get("fingerprint") != fingerprint
+        if self.rebuilt:
+            manifest = build_cache(split_dir, cache_dir, fingerprint)
+        self.classes = manifest["classes"]
+        self.images = np.load(os.path.join(cache_dir, "images.npy"), mmap_mode="r")
+        self.targets = np.load(os.path.join(cache_dir, "labels.npy"))
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, index):
+        # PIL's augmentations are ~3x faster than the tensor versions on CPU
+        image = Image.fromarray(self.images[index])
+        if self.transform:
+            image = self.transform(image)
+        return image, int(self.targets[index])
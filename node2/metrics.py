@@ -0,0 +1,150 @@
+# metrics.py
+#
+# Small Prometheus-style metrics: counters, gauges and histograms with labels.
+# Registry.snapshot() turns everything into plain families (lists and dicts),
+# which nodes push to the broker as-is; render() writes families in the
+# Prometheus text exposition format for the broker's /metrics endpoint.
+# Keep this file identical in broker/ and every node directory.
+
+import bisect
+import math
+import threading
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}  # label key -> value
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def family(self):
+        with self.lock:
+            series = [{"labels": dict(key), "value": value} for key, value in self.values.items()]
+        return {"name": self.name, "type": self.type, "help": self.help, "series": series}
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[label_key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def remove(self, **labels):
+        with self.lock:
+            self.values.pop(label_key(labels), None)
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.values = {}  # label key -> [per-bucket counts (last one is +Inf), sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def family(self):
+        with self.lock:
+            series = [{"labels": dict(key), "counts": list(counts), "sum": total, "count": count}
+                      for key, (counts, total, count) in self.values.items()]
+        return {"name": self.name, "type": self.type, "help": self.help, "buckets": list(self.buckets), "series": series}
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []  # callables returning families computed at snapshot time
+
+    def counter(self, name, help):
+        return self._add(Counter(name, help))
+
+    def gauge(self, name, help):
+        return self._add(Gauge(name, help))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, buckets))
+
+    def collector(self, collect):
+        self.collectors.append(collect)
+        return collect
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        families = [metric.family() for metric in self.metrics]
+        for collect in self.collectors:
+            families.extend(collect())
+        return families
+
+def family(name, type, help, series):
+    """A family computed on the spot, e.g. by a collector; series is a list of (labels, value)."""
+    return {"name": name, "type": type, "help": help,
+            "series": [{"labels": labels, "value": value} for labels, value in series]}
+
+def with_labels(families, **labels):
+    """Copies families with extra labels on every series (e.g. the node a pushed family came from)."""
+    return [{**f, "series": [{**s, "labels": {**s["labels"], **labels}} for s in f["series"]]} for f in families]
+
+def format_value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in sorted(labels.items())) + "}"
+
+def render(families):
+    """Prometheus text format; families with the same name (e.g. from several nodes) are merged."""
+    merged = {}
+    for f in families:
+        entry = merged.setdefault(f["name"], {**f, "series": []})
+        entry["series"].extend(f["series"])
+    lines = []
+    for name, f in merged.items():
+        lines.append(f"# HELP {name} {f['help']}")
+        lines.append(f"# TYPE {name} {f['type']}")
+        for s in f["series"]:
+            if f["type"] != "histogram":
+                lines.append(f"{name}{format_labels(s['labels'])} {format_value(s['value'])}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(f["buckets"]) + [math.inf], s["counts"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels({**s['labels'], 'le': format_value(float(bound))})} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(s['labels'])} {format_value(float(s['sum']))}")
+            lines.append(f"{name}_count{format_labels(s['labels'])} {s['count']}")
+    return "\n".join(lines) + "\n"
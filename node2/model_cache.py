@@ -0,0 +1,84 @@
+# model_cache.py
+
+import os
+import threading
+from collections import OrderedDict
+
+def model_size_bytes(model):
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+class ModelCache:
+    """Keeps loaded models resident, least recently used first out.
+
+    Entries are keyed by (model name, weights file mtime), so retraining a
+    model under the same name is picked up on the next request. Once the
+    summed parameter and buffer size exceeds the memory budget, the least
+    recently used models are evicted (the newest one is always kept).
+    """
+
+    def __init__(self, memory_budget_bytes):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.models = OrderedDict()  # (model_name, mtime) -> (model, size_bytes)
+        self.lock = threading.Lock()
+        self.loading = {}  # model_name -> lock held while that model loads
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key):
+        with self.lock:
+            if key not in self.models:
+                return None
+            self.models.move_to_end(key)
+            self.hits += 1
+            return self.models[key][0]
+
+    def get(self, model_name, model_path, loader):
+        """Returns (model, hit); loader() builds the model on a miss.
+
+        Loading (which can take minutes with torch.compile) holds only that
+        model's lock, so concurrent misses for it load once while hits,
+        other models and stats() go on.
+        """
+        key = (model_name, os.path.getmtime(model_path))
+        model = self._lookup(key)
+        if model is not None:
+            return model, True
+        with self.lock:
+            loading = self.loading.setdefault(model_name, threading.Lock())
+        with loading:
+            model = self._lookup(key)  # another request may have loaded it meanwhile
+            if model is not None:
+                return model, True
+            model = loader()
+            # frozen TorchScript modules hold their weights as constants, so fall back to the file size
+            size = model_size_bytes(model) or os.path.getsize(model_path)
+            with self.lock:
+                self.misses += 1
+                for stale_key in [k for k in self.models if k[0] == model_name]:
+                    self._remove(stale_key)
+                self.models[key] = (model, size)
+                self.total_bytes += size
+                while self.total_bytes > self.memory_budget_bytes and len(self.models) > 1:
+                    self._remove(next(iter(self.models)))
+                    self.evictions += 1
+            return model, False
+
+    def _remove(self, key):
+        _, size = self.models.pop(key)
+        self.total_bytes -= size
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "loaded_models": [name for name, _ in self.models],
+                "memory_bytes": self.total_bytes,
+                "memory_budget_bytes": self.memory_budget_bytes
+            }
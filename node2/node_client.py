@@ -2,6 +2,8 @@
 
 import socket
 import argparse
+import contextlib
+import hashlib
 import json
 import signal
 import sys
@@ -9,16 +11,89 @@ import subprocess
 import os
 import threading
 import time
+import datetime
+
+import torch
+
+import inference
+import profiling
+from batcher import MicroBatcher
+from cpu_budget import CpuBudget, apply_cpu_limits, format_cpu_list, parse_cpu_list
+from metrics import Registry, family
+from model_cache import ModelCache
+from protocol import encode_frame, FrameDecoder, ProtocolError, ENCODING_BINARY, ENCODING_NAMES
+
+RECV_BYTES = 256 * 1024
+DATASET_CACHE_DIR = "cache/dataset"
+COMPILE_CACHE_DIR = "cache/compile"  # shared by training and serving, so kernels compiled once are reused
 
-log_cache = {}
-log_cache_lock = threading.Lock()
 client_socket = None
+send_lock = threading.Lock()
+model_cache = None
+micro_batcher = None
+weights_digests = {}  # model path -> ((size, mtime_ns), sha256 hex)
+cpu_budget = None  # training slots (bounding concurrent train.py subprocesses to --max-trainings) and their CPUs
+training_processes = {}  # train_key -> running train.py subprocess
+pending_trainings = set()  # train_keys received whose subprocess has not started yet
+cancelled_trainings = set()  # pending train_keys that were cancelled
+training_lock = threading.Lock()
+trace_lock = threading.Lock()  # torch.profiler records one trace per process at a time
+
+metrics = Registry()
+inference_requests = metrics.counter("node_inference_requests_total", "Inference requests by kind (single or batch)")
+inference_errors = metrics.counter("node_inference_errors_total", "Failed inference requests by kind")
+inference_latency = metrics.histogram("node_inference_duration_seconds", "Time from receiving an inference request to sending its result")
+batch_sizes = metrics.histogram("node_micro_batch_size", "Requests per micro-batched forward pass", (1, 2, 4, 8, 16, 32, 64))
+training_runs = metrics.counter("node_training_runs_total", "Finished train.py runs by outcome")
+
+@metrics.collector
+def collect_node_state():
+    cache = model_cache.stats()
+    with training_lock:
+        running = len(training_processes)
+    return [
+        family("node_batch_queue_depth", "gauge", "Inference requests waiting for a micro-batch", [({}, micro_batcher.queue_depth())]),
+        family("node_trainings_running", "gauge", "Running train.py subprocesses", [({}, running)]),
+        family("node_model_cache_hits_total", "counter", "Resident model cache hits", [({}, cache["hits"])]),
+        family("node_model_cache_misses_total", "counter", "Resident model cache misses", [({}, cache["misses"])]),
+        family("node_model_cache_evictions_total", "counter", "Resident model cache evictions", [({}, cache["evictions"])]),
+        family("node_model_cache_hit_ratio", "gauge", "Resident model cache hit ratio", [({}, cache["hit_rate"])]),
+        family("node_model_cache_bytes", "gauge", "Memory used by resident models", [({}, cache["memory_bytes"])]),
+    ]
 
 def get_models():
     models_dir = "models"
     if not os.path.exists(models_dir):
         return []
-    return [name for name in os.listdir(models_dir) if os.path.isdir(os.path.join(models_dir, name))]
+    # train_model creates a model's directory before training; it is only a model once its report exists
+    return [name for name in os.listdir(models_dir) if os.path.isfile(os.path.join(models_dir, name, f"{name}.json"))]
+
+def weights_digest(model_name):
+    """SHA-256 of the model's weights file, recomputed only when its size or mtime changes.
+
+    Models without a .pth (int8 variants) are hashed by their TorchScript artifact.
+    """
+    model_path = f"models/{model_name}/{model_name}.pth"
+    if not os.path.exists(model_path):
+        model_path = inference.torchscript_path_for(model_path)
+    try:
+        stat = os.stat(model_path)
+    except OSError:
+        return None
+    signature = (stat.st_size, stat.st_mtime_ns)
+    cached = weights_digests.get(model_path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    weights_digests[model_path] = (signature, digest.hexdigest())
+    return digest.hexdigest()
+
+def get_model_hashes(models):
+    hashes = {name: weights_digest(name) for name in models}
+    return {name: digest for name, digest in hashes.items() if digest}
 
 def send_node_info():
     global client_socket
@@ -26,29 +101,85 @@ def send_node_info():
     message = {
         "type": "NODE INFO",
         "name": args.name,
-        "models": models
+        "models": models,
+        "model_hashes": get_model_hashes(models),
+        "max_trainings": args.max_trainings
     }
     send_json_message(message)
 
+def available_memory_bytes():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def get_capacity():
+    with training_lock:
+        running = len(training_processes)
+    return {
+        "cpu_count": cpu_budget.total,
+        "cpu_budget": cpu_budget.snapshot(),
+        "load_average": os.getloadavg()[0] if hasattr(os, "getloadavg") else None,
+        "memory_available_bytes": available_memory_bytes(),
+        "trainings_running": running,
+        "max_trainings": args.max_trainings,
+        "queue_depth": micro_batcher.queue_depth(),
+        "loaded_models": model_cache.stats()["loaded_models"]
+    }
+
+def send_heartbeat():
+    send_json_message({"type": "CLIENT PING", "name": args.name, "capacity": get_capacity()}, quiet=True)
+
+def send_heartbeats():
+    """The broker evicts nodes that stay silent for longer than its HEARTBEAT_TIMEOUT."""
+    while True:
+        send_heartbeat()
+        time.sleep(args.heartbeat_interval)
+
+def push_metrics():
+    """Sends this node's counters to the broker every --metrics-interval seconds for its /metrics."""
+    while True:
+        time.sleep(args.metrics_interval)
+        send_json_message({"type": "NODE METRICS", "name": args.name, "metrics": metrics.snapshot()}, quiet=True)
+
 def log_message(action, message):
     print(f"[LOG] Action: {action}, Message: {message}")
 
-def send_json_message(message):
+def send_json_message(message, encoding=None, quiet=False):
     global client_socket
     try:
-        json_message = (json.dumps(message) + '\n').encode()
-        client_socket.sendall(json_message)
-        log_message("SEND", message)
+        frame = encode_frame(message, ENCODING_NAMES[args.encoding] if encoding is None else encoding)
+        with send_lock:  # frames from concurrent jobs must not interleave
+            client_socket.sendall(frame)
+        if not quiet:
+            log_message("SEND", message)
     except Exception as e:
         print(f"Error sending message: {e}")
 
+def receive_messages(sock):
+    decoder = FrameDecoder()
+    while True:
+        data = sock.recv(RECV_BYTES)
+        if not data:
+            return
+        for message in decoder.feed(data):
+            yield message
+
 def notify_new_model(model_name):
     models = get_models()
     message = {
         "type": "NEW MODEL ADDED",
         "name": args.name,
         "new_model": model_name,
-        "models": models
+        "models": models,
+        "model_hashes": get_model_hashes(models)
     }
     send_json_message(message)
     log_message("INFO", f"Notified server of new model: {model_name}")
@@ -59,47 +190,94 @@ def notify_termination(host, port, name):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as temp_socket:
             temp_socket.connect((host, port))
             message = {"type": "CLIENT DISCONNECT", "name": name}
-            json_message = json.dumps(message).encode()
-            temp_socket.sendall(json_message)
-            response = temp_socket.recv(1024)
-            response_data = json.loads(response.decode())
+            temp_socket.sendall(encode_frame(message, ENCODING_NAMES[args.encoding]))
+            response_data = next(receive_messages(temp_socket), {})
             log_message("RECEIVE", response_data)
             if response_data.get("type") == "SERVER ACK":
                 print("Disconnected successfully.")
     except Exception as e:
         print(f"Error during termination notification: {e}")
 
-def monitor_log_file(model_name):
-    file_path = f"models/{model_name}/{model_name}.txt"
-    if not os.path.exists(file_path):
-        return
-    with open(file_path, "r") as f:
-        f.seek(0, os.SEEK_END)
-        while True:
-            where = f.tell()
-            line = f.readline()
-            if not line:
-                time.sleep(0.1)
-                f.seek(where)
-            else:
-                with log_cache_lock:
-                    if model_name not in log_cache:
-                        log_cache[model_name] = []
-                    log_cache[model_name].append(line.strip())
-                    log_cache[model_name] = log_cache[model_name][-100:]
+def forward_training_events(read_fd, train_key, model_name):
+    """Relays train.py's JSON line progress events to the server until the pipe closes."""
+    with os.fdopen(read_fd, "r") as events:
+        for line in events:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            send_json_message({
+                "type": "TRAINING_PROGRESS",
+                "name": args.name,
+                "train_key": train_key,
+                "model_name": model_name,
+                "event": event
+            })
+
+def start_training_subprocess(train_key, command, output_file, **popen_args):
+    """Starts train.py, logging to output_file, unless the job was cancelled while it waited; returns the process or None.
+
+    output_file is only opened (and truncated) once the job is known to run,
+    so a cancelled retrain keeps the model's previous log.
+    """
+    with training_lock:
+        pending_trainings.discard(train_key)
+        if train_key in cancelled_trainings:
+            cancelled_trainings.discard(train_key)
+            return None
+        with open(output_file, "w") as f:  # the child keeps its own copy of the descriptor
+            process = subprocess.Popen(command, stdout=f, stderr=subprocess.STDOUT, **popen_args)
+        training_processes[train_key] = process
+        return process
+
+def cancel_training(train_key):
+    with training_lock:
+        process = training_processes.get(train_key)
+        if process is None:
+            # only a job that has yet to start is remembered; a cancel for a finished one is a no-op
+            if train_key in pending_trainings:
+                cancelled_trainings.add(train_key)
+            return
+    log_message("INFO", f"Cancelling training {train_key}")
+    process.terminate()
 
 def run_training_process(train_message):
+    # the broker already limits concurrent jobs; this also keeps direct senders from oversubscribing the CPU
+    train_key = train_message["train_key"]
+    allocation = cpu_budget.acquire(train_key)
+    released = False
+
+    def release_slot():
+        nonlocal released
+        if not released:
+            released = True
+            cpu_budget.release(train_key)
+
+    try:
+        train_model(train_message, allocation, release_slot)
+    finally:
+        release_slot()  # only releases here if train_model raised before freeing the slot itself
+        with training_lock:  # in case train_model failed before starting the subprocess
+            pending_trainings.discard(train_message["train_key"])
+            cancelled_trainings.discard(train_message["train_key"])
+
+def train_model(train_message, allocation=None, release_slot=None):
     model_name = train_message["modelName"]
     base_model = train_message["modelType"]
     epochs = train_message["epochs"]
     batch_size = train_message["batchSize"]
     learning_rate = train_message["learningRate"]
     train_key = train_message["train_key"]
-    output_file = f"models/{model_name}/{model_name}.txt"
+    distributed = train_message.get("distributed")
+    rank = distributed["rank"] if distributed else 0
+    if rank == 0:
+        output_file = f"models/{model_name}/{model_name}.txt"
+    else:
+        # only rank 0 saves the model, so other ranks keep their log out of models/
+        output_file = f"logs/{model_name}.rank{rank}.txt"
     model_save_path = f"models/{model_name}/{model_name}.pth"
     report_path = f"models/{model_name}/{model_name}.json"
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    threading.Thread(target=monitor_log_file, args=(model_name,), daemon=True).start()
     command = [
         "python3", "train.py",
         "--data-dir", "./images",
@@ -108,95 +286,290 @@ def run_training_process(train_message):
         "--batch-size", str(batch_size),
         "--learning-rate", str(learning_rate),
         "--model-save-path", model_save_path,
-        "--report", report_path,
-        "--output-file", output_file
+        "--output-file", output_file,
+        "--dataset-cache", DATASET_CACHE_DIR
     ]
+    read_fd, write_fd = None, None
+    if rank == 0:
+        # rank 0 reports progress events for the whole job over a pipe
+        read_fd, write_fd = os.pipe()
+        command += ["--report", report_path, "--events-fd", str(write_fd)]
+    if "numWorkers" in train_message:
+        command += ["--num-workers", str(train_message["numWorkers"])]
+    if train_message.get("prefetchFactor"):
+        command += ["--prefetch-factor", str(train_message["prefetchFactor"])]
+    if train_message.get("persistentWorkers"):
+        command.append("--persistent-workers")
+    if train_message.get("pinMemory"):
+        command.append("--pin-memory")
+    if train_message.get("torchscript"):
+        command.append("--torchscript")
+    env = None
+    if allocation:
+        # torch, OpenMP and MKL in the subprocess all stay within the slot's share
+        command += ["--num-threads", str(allocation["threads"])]
+        if allocation["cpus"]:
+            command += ["--cpus", format_cpu_list(allocation["cpus"])]
+        env = {**os.environ, "OMP_NUM_THREADS": str(allocation["threads"]), "MKL_NUM_THREADS": str(allocation["threads"])}
+    if train_message.get("channelsLast"):
+        command.append("--channels-last")
+    if train_message.get("compile"):
+        command += ["--compile", "--compile-cache-dir", COMPILE_CACHE_DIR]
+    if train_message.get("precision"):
+        command += ["--precision", train_message["precision"]]
+    if train_message.get("profile"):
+        command.append("--profile")
+    if train_message.get("profileTrace") and rank == 0:
+        # fetched from the broker with /profile_trace?trace=<model>.train
+        command += ["--profile-trace", profiling.trace_path_for(f"{model_name}.train")]
+    if train_message.get("quantize"):
+        # the int8 variant is announced as its own model by notify_new_model below
+        command += ["--quantize", train_message["quantize"]]
+    if distributed:
+        command += [
+            "--world-size", str(distributed["world_size"]),
+            "--rank", str(rank),
+            "--master-addr", distributed["master_addr"],
+            "--master-port", str(distributed["master_port"])
+        ]
     log_message("INFO", f"Starting training subprocess: {' '.join(command)}")
-    with open(output_file, "w") as f:
-        process = subprocess.Popen(command, stdout=f, stderr=subprocess.STDOUT)
+    process = start_training_subprocess(train_key, command, output_file,
+                                        pass_fds=(write_fd,) if write_fd is not None else (), env=env)
+    send_heartbeat()  # reports the slot's CPU allocation
+    if write_fd is not None:
+        os.close(write_fd)  # the child now holds the only write end, so reading stops when it exits
+        forward_training_events(read_fd, train_key, model_name)
+    if process is not None:
         process.wait()
+    with training_lock:
+        training_processes.pop(train_key, None)
+    if release_slot:
+        release_slot()
+    send_heartbeat()  # report the freed slot before the broker starts the next queued job
+    if process is None or process.returncode < 0:
+        training_runs.inc(outcome="cancelled")
+    else:
+        training_runs.inc(outcome="completed" if process.returncode == 0 else "failed")
     log_message("INFO", f"Training completed for model: {model_name}")
-    with open(output_file, "r") as f:
-        output_contents = f.read()
+    output_contents = ""  # a job cancelled before it started wrote no output
+    if process is not None:
+        with open(output_file, "r") as f:
+            output_contents = f.read()
     response = {
         "type": "TRAINING_COMPLETED",
         "name": args.name,
         "train_key": train_key,
         "model_name": model_name,
+        "rank": rank,
+        "weights_hash": weights_digest(model_name) if rank == 0 else None,
         "data": {
             "model_path": model_save_path,
             "report_path": report_path,
             "output_file": output_file,
-            "output_contents": output_contents
+            "output_contents": output_contents,
+            "returncode": process.returncode if process is not None else None
         }
     }
     send_json_message(response)
-    notify_new_model(model_name)
+    if rank == 0 and process is not None and process.returncode == 0:
+        notify_new_model(model_name)
 
-def run_inference_process(inference_message):
-    global client_socket
-
-    print(f"Running inference process")
-
-    image_path = inference_message["image_path"]
-    model_name = inference_message["model_name"]
+def load_model_config(model_name):
+    # read the training report for the base_model, class_names_path, and the model_path
     train_report_path = f"models/{model_name}/{model_name}.json"
-    # print(f"train_report_path: {train_report_path}")
-    # print(f"model_name: {model_name}")
-    # print(f"image_path: {image_path}")
-    # read report_path for the base_model, class_names_path, and the model_path
     with open(train_report_path, "r") as f:
         report = json.load(f)
-    model_path = report["model_save_path"]
-    base_model = report["arguments"]["base_model"]
-    class_names_path = report["arguments"]["data_dir"] + "/classes.txt"
-    # base_model = inference_message["base_model"]
-    # class_names_path = inference_message["class_names_path"]
-    report_path = f"models/{model_name}/{inference_message['inference_key']}.json"
+    return {
+        "model_path": report["model_save_path"],
+        "base_model": report["arguments"]["base_model"],
+        "class_names_path": report["arguments"]["data_dir"] + "/classes.txt",
+        "torchscript_path": (report.get("torchscript") or {}).get("path")
+    }
 
-    # lo all variables
-    # print(f"image_path: {image_path}")
-    # print(f"model_path: {model_path}")
-    # print(f"base_model: {base_model}")
-    # print(f"class_names_path: {class_names_path}")
-    # print(f"train_report_path: {train_report_path}")
-    # print(f"report_path: {report_path}")
+def load_cached_model(model_name):
+    config = load_model_config(model_name)
+    class_names = inference.load_class_names(config["class_names_path"])
+    torchscript_path = config["torchscript_path"]
+    if torchscript_path and not os.path.exists(torchscript_path):
+        torchscript_path = None
+    model, hit = model_cache.get(
+        model_name, torchscript_path or config["model_path"],
+        lambda: inference.prepare_model(
+            inference.load_model(config["base_model"], len(class_names), config["model_path"], torchscript_path),
+            args.channels_last, args.compile, COMPILE_CACHE_DIR))
+    return config, class_names, model, hit
 
+def on_micro_batch(size):
+    # runs on the batcher's thread right before its forward pass
+    batch_sizes.observe(size)
+    cpu_budget.apply_inference_threads()
 
+def warm_model_cache():
+    """Loads (and compiles) every model up front, since a cold torch.compile takes longer than the broker waits."""
+    for model_name in get_models():
+        try:
+            load_cached_model(model_name)
+            log_message("INFO", f"Warmed up {model_name}")
+        except Exception as e:
+            log_message("WARNING", f"Could not warm up {model_name}: {e}")
 
-    command = [
-        "python3", "inference.py",
-        "--image-path", image_path,
-        "--model-path", model_path,
-        "--base-model", base_model,
-        "--class-names-path", class_names_path,
-        "--report", report_path
-    ]
-    log_message("INFO", f"Starting inference subprocess: {' '.join(command)}")
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = process.communicate()
-    if os.path.exists(report_path):
-        with open(report_path, "r") as f:
-            inference_result = json.load(f)
-        response = {
+def run_profiled_inference(inference_message, image_source, precision):
+    """Serves a request that asked for a profile on this thread, outside the micro-batcher, so every stage is its own.
+
+    With profileTrace the request is also recorded with torch.profiler; the
+    trace is saved under profiles/ and the response's profile names its id.
+    """
+    model_name = inference_message["model_name"]
+    trace_id = None
+    if inference_message.get("profileTrace"):
+        trace_id = f"{model_name}.{inference_message['inference_key'].rsplit(':', 1)[-1]}"
+    with trace_lock if trace_id else contextlib.nullcontext():
+        with profiling.Profiler(trace_path=profiling.trace_path_for(trace_id) if trace_id else None) as profiler:
+            with profiler.stage("load"):
+                config, class_names, model, hit = load_cached_model(model_name)
+            with profiler.stage("preprocess"):
+                image = inference.preprocess_image(image_source)
+            precision = inference.resolve_precision(precision, model)
+            cpu_budget.apply_inference_threads()
+            prediction = inference.predict_batch(image, model, class_names, precision, profiler)[0]
+    return config, precision, prediction, {**profiler.summary(), "trace_id": trace_id}
+
+def run_inference_process(inference_message):
+    # uploads arrive as image_bytes (a view into the received frame) instead of a local image_path
+    image_path = inference_message.get("image_path")
+    image_bytes = inference_message.get("image_bytes")
+    image_name = image_path or inference_message.get("image_name", "upload")
+    model_name = inference_message["model_name"]
+    inference_key = inference_message["inference_key"]
+    precision = inference_message.get("precision") or args.precision
+
+    started = time.perf_counter()
+    inference_requests.inc(kind="single")
+
+    def send_error(error):
+        inference_errors.inc(kind="single")
+        send_json_message({
+            "type": "ERROR",
+            "name": args.name,
+            "message": f"Inference failed: {error}",
+            "inference_key": inference_key
+        })
+
+    def on_prediction(prediction, error, profile=None):
+        if error is not None:
+            send_error(error)
+            return
+        predicted_class, results = prediction
+        arguments = {"image_path": image_path, "model_name": model_name, "precision": precision, **config}
+        send_json_message({
             "type": "JSON_RESPONSE",
-            "inference_key": inference_message["inference_key"],
-            "data": inference_result
-        }
-    else:
-        response = {
+            "name": args.name,
+            "inference_key": inference_key,
+            "model_cache": model_cache.stats(),
+            "data": inference.build_report(arguments, image_name, predicted_class, results, profile)
+        })
+        inference_latency.observe(time.perf_counter() - started, kind="single")
+
+    if inference_message.get("profile") or inference_message.get("profileTrace"):
+        try:
+            config, precision, prediction, profile = run_profiled_inference(
+                inference_message, image_path if image_bytes is None else image_bytes, precision)
+        except Exception as e:
+            send_error(e)
+            return
+        on_prediction(prediction, None, profile)
+        return
+
+    try:
+        config, class_names, model, hit = load_cached_model(model_name)
+        log_message("INFO", f"Queueing inference with {model_name} ({'cache hit' if hit else 'cache miss'})")
+        image = inference.preprocess_image(image_path if image_bytes is None else image_bytes)
+    except Exception as e:
+        send_error(e)
+        return
+    precision = inference.resolve_precision(precision, model)
+    # Decoding happens on this thread; the forward pass is batched with other requests for the model
+    micro_batcher.submit(model_name, model, class_names, image, on_prediction, precision)
+
+def run_batch_inference_process(batch_message):
+    image_paths = batch_message["image_paths"]
+    model_name = batch_message["model_name"]
+    batch_key = batch_message["batch_key"]
+    precision = batch_message.get("precision") or args.precision
+    started = time.perf_counter()
+    inference_requests.inc(kind="batch")
+    try:
+        config, class_names, model, hit = load_cached_model(model_name)
+    except Exception as e:
+        inference_errors.inc(kind="batch")
+        send_json_message({
             "type": "ERROR",
-            "message": "Inference report not found",
-            "inference_key": inference_message["inference_key"]
+            "name": args.name,
+            "message": f"Batch inference failed: {e}",
+            "batch_key": batch_key
+        })
+        return
+    log_message("INFO", f"Running batch of {len(image_paths)} images with {model_name} ({'cache hit' if hit else 'cache miss'})")
+    cpu_budget.apply_inference_threads()
+    precision = inference.resolve_precision(precision, model)
+
+    results = [None] * len(image_paths)
+    images = []  # (index, tensor) for every image that decoded
+    for index, image_path in enumerate(image_paths):
+        try:
+            images.append((index, inference.preprocess_image(image_path)))
+        except Exception as e:
+            results[index] = {"image": image_path, "error": str(e)}
+    for start in range(0, len(images), args.max_batch_size):
+        chunk = images[start:start + args.max_batch_size]
+        try:
+            predictions = inference.predict_batch(torch.cat([image for _, image in chunk]), model, class_names, precision)
+        except Exception as e:
+            predictions = [e] * len(chunk)
+        for (index, _), prediction in zip(chunk, predictions):
+            if isinstance(prediction, Exception):
+                results[index] = {"image": image_paths[index], "error": str(prediction)}
+            else:
+                predicted_class, output = prediction
+                results[index] = {"image": image_paths[index], "predicted_class": predicted_class, "output": output}
+
+    send_json_message({
+        "type": "JSON_RESPONSE",
+        "name": args.name,
+        "batch_key": batch_key,
+        "model_cache": model_cache.stats(),
+        "data": {
+            "timestamp": datetime.datetime.now().isoformat(),
+            "arguments": {"model_name": model_name, "precision": precision, **config},
+            "results": results
         }
-    send_json_message(response)
+    })
+    inference_latency.observe(time.perf_counter() - started, kind="batch")
 
 def handle_train_request(train_message):
+    with training_lock:
+        pending_trainings.add(train_message["train_key"])
     threading.Thread(target=run_training_process, args=(train_message,), daemon=True).start()
 
 def handle_inference_request(inference_message):
     threading.Thread(target=run_inference_process, args=(inference_message,), daemon=True).start()
 
+def handle_batch_inference_request(batch_message):
+    threading.Thread(target=run_batch_inference_process, args=(batch_message,), daemon=True).start()
+
+def send_trace(message):
+    """Sends a saved profiler trace as raw bytes in a binary frame, so it is not parsed and re-encoded on the way."""
+    request_key = message.get("request_key")
+    try:
+        with open(profiling.trace_path_for(message.get("trace")), "rb") as f:
+            trace = f.read()
+    except (OSError, ValueError) as e:
+        send_json_message({"type": "ERROR", "name": args.name, "request_key": request_key,
+                           "message": f"Trace '{message.get('trace')}' not available: {e}"})
+        return
+    send_json_message({"type": "JSON_RESPONSE", "name": args.name, "request_key": request_key,
+                       "data": {"trace": trace}}, ENCODING_BINARY, quiet=True)
+
 def handle_server_message(message):
     msg_type = message.get("type")
     if msg_type == "SERVER TRAIN":
@@ -207,12 +580,14 @@ def handle_server_message(message):
     elif msg_type == "GET_JSON":
         json_name = message.get("json_name")
         node_name = message.get("name")
+        request_key = message.get("request_key")
         file_path = f"models/{json_name}/{json_name}.json"
         if not os.path.exists(file_path):
             response = {
                 "type": "ERROR",
                 "name": node_name,
                 "json_name": json_name,
+                "request_key": request_key,
                 "message": f"File '{file_path}' not found"
             }
         else:
@@ -222,13 +597,22 @@ def handle_server_message(message):
                 "type": "JSON_RESPONSE",
                 "name": node_name,
                 "json_name": json_name,
+                "request_key": request_key,
                 "data": json_data
             }
         send_json_message(response)
+    elif msg_type == "GET_TRACE":
+        threading.Thread(target=send_trace, args=(message,), daemon=True).start()
     elif msg_type == "SERVER INFERENCE":
         log_message("RECEIVE", message)
         inference_message = message
         handle_inference_request(inference_message)
+    elif msg_type == "SERVER BATCH INFERENCE":
+        log_message("RECEIVE", message)
+        handle_batch_inference_request(message)
+    elif msg_type == "SERVER CANCEL TRAIN":
+        log_message("RECEIVE", message)
+        cancel_training(message["train_key"])
 
 def start_client(host, port, name):
     global client_socket
@@ -242,27 +626,24 @@ def start_client(host, port, name):
         connect_message = {"type": "CLIENT CONNECT", "name": name}
         send_json_message(connect_message)
         send_node_info()
-        response = client_socket.recv(1024)
-        if response:
-            response_data = json.loads(response.decode())
+        threading.Thread(target=send_heartbeats, daemon=True).start()
+        if args.compile:
+            threading.Thread(target=warm_model_cache, daemon=True).start()
+        threading.Thread(target=push_metrics, daemon=True).start()
+        messages = receive_messages(client_socket)
+        response_data = next(messages, None)
+        if response_data:
             log_message("RECEIVE", response_data)
             if response_data.get("type") != "SERVER ACK":
                 print("Failed to connect to server.")
                 return
-        while True:
+        for message in messages:
             try:
-                data = client_socket.recv(4096).decode()
-                if not data:
-                    break
-                messages = data.strip().split('\n')
-                for msg in messages:
-                    if msg:
-                        message = json.loads(msg)
-                        handle_server_message(message)
-            except json.JSONDecodeError:
-                print("Invalid message format received.")
+                handle_server_message(message)
             except Exception as e:
                 print(f"Error handling server message: {e}")
+    except ProtocolError as e:
+        print(f"Invalid message format received: {e}")
     except Exception as e:
         print(f"Connection error: {e}")
     finally:
@@ -274,5 +655,23 @@ if __name__ == "__main__":
     parser.add_argument("--host", default="127.0.0.1", help="Server host (default: 127.0.0.1)")
     parser.add_argument("--port", type=int, default=8000, help="Server port (default: 8000)")
     parser.add_argument("--name", required=True, help="Node name (e.g., node0)")
+    parser.add_argument("--encoding", choices=ENCODING_NAMES, default="json", help="Payload encoding for messages sent to the broker (default: json)")
+    parser.add_argument("--model-cache-mb", type=int, default=1024, help="Memory budget for resident inference models in MB (default: 1024)")
+    parser.add_argument("--batch-window-ms", type=float, default=5, help="How long to wait for more inference requests to batch with the first one (default: 5)")
+    parser.add_argument("--max-batch-size", type=int, default=16, help="Maximum number of inference requests per forward pass (default: 16)")
+    parser.add_argument("--max-trainings", type=int, default=1, help="Maximum number of concurrent training jobs (default: 1)")
+    parser.add_argument("--precision", choices=inference.PRECISIONS, default="fp32", help="Default inference precision; requests may override it (default: fp32)")
+    parser.add_argument("--channels-last", action="store_true", help="Serve eager models in channels_last memory format")
+    parser.add_argument("--compile", action="store_true", help="Serve eager models compiled with torch.compile (kernels are cached in cache/compile)")
+    parser.add_argument("--heartbeat-interval", type=float, default=5, help="Seconds between heartbeats with capacity data to the broker (default: 5)")
+    parser.add_argument("--cpus", type=parse_cpu_list, help="Cores this node may use, e.g. 0-3 or 0,2,4 (default: all available)")
+    parser.add_argument("--threads", type=int, help="Thread budget when no --cpus core set is given (default: available cores)")
+    parser.add_argument("--inference-cpus", type=int, default=1, help="CPUs kept for inference while trainings run (default: 1)")
+    parser.add_argument("--metrics-interval", type=float, default=10, help="Seconds between metrics pushes to the broker (default: 10)")
     args = parser.parse_args()
+    model_cache = ModelCache(args.model_cache_mb * 1024 * 1024)
+    cpu_budget = CpuBudget(args.cpus, args.threads, args.max_trainings, args.inference_cpus)
+    # before any torch work, so every thread the node starts inherits the pinning
+    apply_cpu_limits(args.cpus, cpu_budget.inference_threads(), interop_threads=1)
+    micro_batcher = MicroBatcher(args.batch_window_ms, args.max_batch_size, on_batch=on_micro_batch)
     start_client(args.host, args.port, args.name)
@@ -15,17 +15,26 @@ tmux send-keys -t broker "python3 node_server.py" C-m
 
 sleep 1
 
+# give each node its own third of the cores, so the three nodes' torch threads do not compete
+CORES=$(nproc)
+PER_NODE=$((CORES / 3))
+node_cpus() {
+    if [ "$PER_NODE" -ge 1 ]; then
+        echo "--cpus $(($1 * PER_NODE))-$((($1 + 1) * PER_NODE - 1))"
+    fi
+}
+
 tmux new-session -d -s node0
 tmux send-keys -t node0 "cd node0" C-m
-tmux send-keys -t node0 "python3 node_client.py --name node0" C-m
+tmux send-keys -t node0 "python3 node_client.py --name node0 $(node_cpus 0)" C-m
 
 tmux new-session -d -s node1
 tmux send-keys -t node1 "cd node1" C-m
-tmux send-keys -t node1 "python3 node_client.py --name node1" C-m
+tmux send-keys -t node1 "python3 node_client.py --name node1 $(node_cpus 1)" C-m
 
 tmux new-session -d -s node2
 tmux send-keys -t node2 "cd node2" C-m
-tmux send-keys -t node2 "python3 node_client.py --name node2" C-m
+tmux send-keys -t node2 "python3 node_client.py --name node2 $(node_cpus 2)" C-m
 
 tmux new-session -d -s frontend
 tmux send-keys -t frontend "cd frontend" C-m